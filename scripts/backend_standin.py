@@ -0,0 +1,91 @@
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# Local stand-in for the Cauli API, to test the backend client without the network
+# POST /collections {"collections": [{"timestamp", "type", "id"}, ...]} -> {"accepted": n}
+# Latency and failures can be injected to check that the machine keeps accepting cups
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections, like the real API
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if random.random() < server.failure_rate:
+            self._reply(503, {'error': 'injected failure'})
+            return
+        if self.path != '/collections':
+            self._reply(404, {'error': 'not found'})
+            return
+        try:
+            collections = json.loads(body)['collections']
+        except (ValueError, KeyError, TypeError):
+            self._reply(400, {'error': 'invalid payload'})
+            return
+        with server.lock:
+            server.requests += 1
+            # Confirmations may be sent more than once (retries): deduplicate them
+            for c in collections:
+                server.collections[(c['timestamp'], c['type'], c['id'])] = c
+        self._reply(200, {'accepted': len(collections)})
+
+    def do_GET(self):
+        if self.path != '/collections':
+            self._reply(404, {'error': 'not found'})
+            return
+        with self.server.lock:
+            self._reply(200, {'collections': list(self.server.collections.values()), 'requests': self.server.requests})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(host='127.0.0.1', port=8080, latency=0.0, failure_rate=0.0, verbose=False):
+    # Start the stand-in server in a background thread and return it (server.shutdown() to stop)
+    server = ThreadingHTTPServer((host, port), StandInHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.failure_rate = failure_rate
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.collections = {}
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, name='StandInBackend', daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Cauli API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='delay added to every request (seconds)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.latency, args.failure_rate, verbose=True)
+    print(f"Stand-in backend listening on http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"{len(server.collections)} collections received in {server.requests} requests")
@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Make the src package (and main.py) importable when running from the scripts folder
+sys.path.insert(0, ROOT)
+from simulate import parse_weights
+
+
+# End-to-end benchmark of the collection cycle on recorded fixtures, without hardware (see
+# simulate.py): every stage is driven on its own, then the whole main.py cycle
+# Each scenario runs in a fresh process, in a scratch working directory (its own ./data, with
+# ./models linked to the repository's), so that its peak RSS and state are its own
+# The results are written as JSON; compare two runs on the same reference machine with --baseline
+#
+# Example: python scripts/benchmark.py --side recordings/side --top recordings/top --fps 15 \
+#              --weights 0:0,1.5:45,7:0 --period 10 --output benchmarks/v1.2.json
+
+FORMAT_VERSION = 1
+
+SCENARIOS = ('motion', 'colour', 'qr_code', 'qr_payload', 'object_detection', 'tracking', 'backend', 'cycle')
+# Iterations of each scenario (calls of the stage, or collection cycles)
+ITERATIONS = {
+    'motion': 10,
+    'colour': 20,
+    'qr_code': 20,
+    'qr_payload': 100_000,
+    'object_detection': 50,
+    'tracking': 3,
+    'backend': 10_000,
+    'cycle': 5,
+}
+# Maximum duration of a scenario (seconds); e.g. motion detection never returns on a still fixture
+SCENARIO_TIMEOUT = 600
+
+# Stage timers, as in main.py
+COLOUR_TIMER = 5.0
+QR_TIMER = 8.0
+TRACKING_TIMER = 6.0
+IRIS_OPEN_DELAY = 1
+DETECTION_TRIES = 1
+# Tracking box used when the model cannot be run to seed the tracker (x, y, width, height)
+DEFAULT_BBOX = (220, 140, 200, 200)
+
+PAYLOADS = (
+    "https://wearecauli.test-app.link/container-0001-8295f584-f45d-490c-5466-2654a546",
+    "https://wearecauli.test-app.link/container-0000-0a1b2c3d-4e5f-6a7b-8c9d-0e1f2a3b",
+    "https://wearecauli.test-app.link/container-0007-8295f584-f45d-490c-5466-2654a546",
+    "https://example.com/container-0001-8295f584-f45d-490c-5466-2654a546",
+    "not a cauli code",
+)
+CONTAINER = {'type': 'cup', 'id': '8295f584-f45d-490c-5466-2654a546'}
+
+
+# --- Scenarios (run in the child process) ---
+
+def run_scenario(name, args):
+    from src import hardware, metrics
+    metrics.ROLLING_WINDOW = max(metrics.ROLLING_WINDOW, args.iterations or ITERATIONS[name])
+    hardware.configure(simulation=True, speed=args.speed, sleep_scale=0.0, fps=args.fps,
+                       load_cell_trace=hardware.LoadCellTrace(parse_weights(args.weights), loop_period=args.period))
+    import main
+    hardware.configure(recordings={main.SIDE_CAMERA_ID: args.side, main.TOP_CAMERA_ID: args.top})
+
+    iterations = args.iterations or ITERATIONS[name]
+    result = {'iterations': iterations}
+    start = time.monotonic()
+    outcomes, cameras = SCENARIO_FUNCTIONS[name](main, iterations)
+    result['duration'] = time.monotonic() - start
+    result['iterations_per_second'] = iterations / result['duration']
+
+    # Frames handed out to the stages by the cameras (none for the stages without a camera)
+    frames = sum(camera.reads for camera in cameras) if cameras else None
+    result['frames'] = frames
+    result['frames_per_second'] = None if frames is None else frames / result['duration']
+    result['outcomes'] = outcomes
+    result['events'] = metrics.counters()
+    result['latency'] = metrics.summary()
+    main.cameras.release_all()
+    main.object_detection.stop_service()
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS); the children are the inference worker
+    scale = 1 if sys.platform == 'darwin' else 1024
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+    result['peak_rss_children_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2**20
+    return result
+
+def count(outcomes, value):
+    outcomes[str(value)] = outcomes.get(str(value), 0) + 1
+
+def side_camera(main, fps=15):
+    return main.cameras.get(main.SIDE_CAMERA_ID, resolution=(640,480), fps=fps, autofocus=False)
+
+def top_camera(main):
+    return main.cameras.get(main.TOP_CAMERA_ID, resolution=(640,480), fps=15, autofocus=True)
+
+def bench_motion(main, iterations):
+    camera = side_camera(main)
+    outcomes = {}
+    for _ in range(iterations):
+        with main.metrics.span('motion_detection.loop'):
+            count(outcomes, main.motion_detection.loop(camera=camera, crop_ratio=1))
+    return outcomes, [camera]
+
+def bench_colour(main, iterations):
+    camera = side_camera(main)
+    outcomes = {}
+    for _ in range(iterations):
+        with main.metrics.span('colour_detection.start'):
+            count(outcomes, main.validation.colour_detection.start(camera=camera, timer=COLOUR_TIMER, crop_ratio=main.validation.COLOUR_CROP_RATIO))
+    return outcomes, [camera]
+
+def bench_qr_code(main, iterations):
+    camera = top_camera(main)
+    outcomes = {}
+    for _ in range(iterations):
+        with main.metrics.span('qr_code.detect'):
+            code = main.validation.qr_code.detect(camera, timer=QR_TIMER, crop_ratio=main.validation.QR_CROP_RATIO)
+        count(outcomes, code is not None)
+    return outcomes, [camera]
+
+def bench_qr_payload(main, iterations):
+    # Per-call timings (measured around the call only, the histogram update is not timed)
+    outcomes = {}
+    for i in range(iterations):
+        payload = PAYLOADS[i % len(PAYLOADS)]
+        start = time.perf_counter()
+        cup = main.validation.qr_code.process(payload)
+        main.metrics.observe('qr_code.process', time.perf_counter() - start)
+        if i < len(PAYLOADS):
+            count(outcomes, cup is not None)
+    return outcomes, []
+
+def bench_object_detection(main, iterations):
+    main.object_detection.start_service()
+    camera = side_camera(main, fps=20)
+    outcomes = {}
+    for _ in range(iterations):
+        with main.metrics.span('object_detection.run'):
+            _, bbox = main.object_detection.run(camera=camera, tries=DETECTION_TRIES)
+        count(outcomes, bbox is not None)
+    return outcomes, [camera]
+
+def bench_tracking(main, iterations):
+    # The inference worker is forked before the camera grabber threads start
+    has_model = os.path.exists(main.object_detection.MODEL_PATH)
+    if has_model:
+        main.object_detection.start_service()
+    camera = side_camera(main, fps=20)
+    bbox = DEFAULT_BBOX
+    if has_model:
+        _, detected_bbox = main.object_detection.run(camera=camera, tries=10)
+        if detected_bbox is not None:
+            bbox = detected_bbox
+    outcomes = {}
+    for _ in range(iterations):
+        with main.metrics.span('object_tracking.track_and_open_iris'):
+            tracked_bbox, dims, uncertainty, history = main.object_tracking.track_and_open_iris(camera, bbox, timer=TRACKING_TIMER, iris_open_delay=IRIS_OPEN_DELAY)
+        main.iris.close()
+        if (tracked_bbox is None) or (uncertainty is None):
+            count(outcomes, None)
+            continue
+        with main.metrics.span('object_tracking.validate'):
+            count(outcomes, main.object_tracking.validate(tracked_bbox, dims, uncertainty, history))
+    return outcomes, [camera]
+
+def bench_backend(main, iterations):
+    outcomes = {}
+    for _ in range(iterations):
+        with main.metrics.span('backend.record_collection'):
+            count(outcomes, main.backend.record_collection(CONTAINER, status="Collected"))
+    # Includes the final commit of the journal
+    with main.metrics.span('backend.close'):
+        main.backend.close()
+    return outcomes, []
+
+def bench_cycle(main, iterations):
+    # The cameras are opened beforehand, so that their frame counts outlive main(); the inference
+    # worker is forked before their grabber threads start (main() then reuses the service)
+    main.object_detection.start_service()
+    cameras = [side_camera(main), top_camera(main)]
+    main.main(max_cycles=iterations)
+    return {event[len('cycle_'):]: n for event, n in main.metrics.counters().items() if event.startswith('cycle_')}, cameras
+
+SCENARIO_FUNCTIONS = {
+    'motion': bench_motion,
+    'colour': bench_colour,
+    'qr_code': bench_qr_code,
+    'qr_payload': bench_qr_payload,
+    'object_detection': bench_object_detection,
+    'tracking': bench_tracking,
+    'backend': bench_backend,
+    'cycle': bench_cycle,
+}
+
+
+# --- Driver (parent process) ---
+
+def machine_info():
+    import cv2
+    import numpy as np
+    return {'platform': platform.platform(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpu_count': os.cpu_count(), 'python': platform.python_version(),
+            'opencv': cv2.__version__, 'numpy': np.__version__}
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def spawn(name, args):
+    # Run one scenario in a fresh process and scratch directory; returns its result
+    workdir = tempfile.mkdtemp(prefix=f'cauli-benchmark-{name}-')
+    try:
+        os.makedirs(os.path.join(workdir, 'data'))
+        models = os.path.join(os.path.abspath(ROOT), 'models')
+        if os.path.exists(models):
+            os.symlink(models, os.path.join(workdir, 'models'))
+        output = os.path.join(workdir, 'result.json')
+        command = [sys.executable, os.path.abspath(__file__), '--scenario', name, '--result', output,
+                   '--side', os.path.abspath(args.side), '--top', os.path.abspath(args.top),
+                   '--speed', str(args.speed), '--weights', args.weights]
+        for option, value in (('--fps', args.fps), ('--period', args.period), ('--iterations', args.iterations)):
+            if value is not None:
+                command += [option, str(value)]
+        environment = dict(os.environ, CAULI_DISPLAY='none')
+        try:
+            with open(os.path.join(workdir, 'output.txt'), 'w') as log:
+                process = subprocess.run(command, cwd=workdir, env=environment, stdout=log, stderr=subprocess.STDOUT, timeout=args.timeout)
+        except subprocess.TimeoutExpired:
+            return {'error': f'timed out after {args.timeout}s'}
+        if process.returncode != 0 or not os.path.exists(output):
+            with open(os.path.join(workdir, 'output.txt')) as log:
+                tail = log.read().strip().splitlines()[-5:]
+            return {'error': f'exit status {process.returncode}', 'output': tail}
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(results, baseline):
+    # Print the change of the latency percentiles of every stage against a baseline run
+    print(f"\n{'scenario':<17}{'stage':<38}{'p50':>10}{'p95':>10}{'p99':>10}", file=sys.stderr)
+    for name, result in results['scenarios'].items():
+        reference = baseline.get('scenarios', {}).get(name, {})
+        for stage, summary in (result.get('latency') or {}).items():
+            before = (reference.get('latency') or {}).get(stage)
+            if not summary or not before:
+                continue
+            changes = [f"{(summary[p] / before[p] - 1) * 100:+9.1f}%" if before[p] else f"{'n/a':>10}" for p in ('p50', 'p95', 'p99')]
+            print(f"{name:<17}{stage:<38}{''.join(changes)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the collection cycle stages on recorded fixtures (JSON output).")
+    parser.add_argument('--side', required=True, help='recording of the side camera (video file or frame directory)')
+    parser.add_argument('--top', required=True, help='recording of the top camera (video file or frame directory)')
+    parser.add_argument('--fps', type=float, default=None, help='frame rate of the recordings (default: from the video files)')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed (1: real time, 0: as fast as possible)')
+    parser.add_argument('--weights', default='0:0', help='load cell trace, as "time:grams" steps (seconds from the start)')
+    parser.add_argument('--period', type=float, default=None, help='period of the load cell trace (seconds), to repeat it')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'comma-separated scenarios among {", ".join(SCENARIOS)}')
+    parser.add_argument('--iterations', type=int, default=None, help='iterations of every scenario (default: per scenario)')
+    parser.add_argument('--timeout', type=float, default=SCENARIO_TIMEOUT, help='maximum duration of a scenario (seconds)')
+    parser.add_argument('--output', default=None, help='JSON file to write (default: standard output)')
+    parser.add_argument('--baseline', default=None, help='JSON file of an earlier run to compare the latencies with')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directories (logs, journal, metrics)')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        # Child process: run one scenario
+        result = run_scenario(args.scenario, args)
+        with open(args.result, 'w') as f:
+            json.dump(result, f)
+        sys.exit(0)
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(unknown)}')
+
+    results = {'format_version': FORMAT_VERSION, 'timestamp': time.time(), 'revision': git_revision(),
+               'machine': machine_info(),
+               'fixtures': {'side': args.side, 'top': args.top, 'fps': args.fps, 'speed': args.speed,
+                            'weights': args.weights, 'period': args.period},
+               'scenarios': {}}
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        result = results['scenarios'][name] = spawn(name, args)
+        if 'error' in result:
+            print(f"  failed: {result['error']}", file=sys.stderr)
+        else:
+            fps = result['frames_per_second']
+            print(f"  {result['iterations']} iterations in {result['duration']:.1f}s"
+                  f"{'' if fps is None else f', {fps:.1f} frames/s'}, peak RSS {result['peak_rss_mb']:.0f} MB", file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
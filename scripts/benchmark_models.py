@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+# Make the src package importable when running from the scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src import batch_detection, object_detection
+
+
+# Compare the latency and accuracy of the detection models (by default fp16 and int8) on the same
+# fixtures: one interpreter with the threads of the live service, as in object_detection.run
+# Without labels, the accuracy is reported as the agreement of each model with the first one
+#
+# Example: python scripts/benchmark_models.py dataset/frames --labels dataset/labels.csv
+
+
+def frame_decisions(columns, threshold, class_name='cauli'):
+    # Whether each frame contains the class at `threshold`, by frame name
+    class_id = object_detection.CLASS_LABELS.index(class_name)
+    selected = (columns['class_id'] == class_id) & (columns['score'] >= threshold)
+    detected = np.zeros(len(columns['names']), dtype=bool)
+    detected[columns['frame'][selected]] = True
+    return dict(zip(columns['names'], detected))
+
+def latency_summary(latencies):
+    latencies = np.sort(latencies)
+    return {'mean': float(latencies.mean()), 'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95)), 'max': float(latencies[-1])}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the latency and accuracy of detection models on the same frames.")
+    parser.add_argument('source', help='directory of images or video file')
+    parser.add_argument('--models', default=','.join(object_detection.MODELS), help='model names (see object_detection.MODELS) or paths')
+    parser.add_argument('--labels', default=None, help='CSV of "frame,class,x,y,width,height" rows (pixels)')
+    parser.add_argument('--threads', type=int, default=object_detection.NUM_THREADS, help='interpreter threads')
+    parser.add_argument('--threshold', type=float, default=object_detection.CONFIDENCE_THRESHOLD, help='confidence threshold')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    labels = batch_detection.load_labels(args.labels) if args.labels else None
+    results = {}
+    reference = None
+    for model in args.models.split(','):
+        model_path = object_detection.MODELS.get(model, model)
+        columns = batch_detection.detect_all(args.source, model_path, interpreters=1, threads=args.threads)
+        # The workers are warmed up before the first frame: every latency counts
+        result = {'model_path': model_path, 'frames': len(columns['names']),
+                  'frames_per_second': len(columns['names']) / float(columns['duration']),
+                  'interpreter_latency': latency_summary(columns['latencies'])}
+        decisions = frame_decisions(columns, args.threshold)
+        if reference is None:
+            reference = decisions
+        else:
+            common = [name for name in decisions if name in reference]
+            result['agreement'] = sum(decisions[name] == reference[name] for name in common) / max(len(common), 1)
+        if labels is not None:
+            result['accuracy'] = [row for row in batch_detection.evaluate(columns, labels, [args.threshold]) if row['class'] == 'cauli'][0]
+        results[model] = result
+
+    first = next(iter(results.values()))
+    print(f"\n{'model':<8}{'frames/s':>10}{'mean':>10}{'p50':>10}{'p95':>10}{'speed-up':>10}{'agreement':>11}{'precision':>11}{'recall':>8}")
+    for model, result in results.items():
+        latency = result['interpreter_latency']
+        speed_up = first['interpreter_latency']['mean'] / latency['mean']
+        agreement = f"{result['agreement'] * 100:.1f}%" if 'agreement' in result else '-'
+        accuracy = result.get('accuracy') or {}
+        precision, recall = [('n/a' if accuracy.get(k) is None else f"{accuracy[k] * 100:.1f}%") if accuracy else '-' for k in ('precision', 'recall')]
+        print(f"{model:<8}{result['frames_per_second']:>10.1f}{latency['mean'] * 1000:>8.1f}ms{latency['p50'] * 1000:>8.1f}ms"
+              f"{latency['p95'] * 1000:>8.1f}ms{speed_up:>9.2f}x{agreement:>11}{precision:>11}{recall:>8}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'threshold': args.threshold, 'threads': args.threads, 'models': results}, f, indent=2)
@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+# Make the src package importable when running from the scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src.preprocessing import Preprocessor
+
+FRAME_SHAPE = (480, 640, 3)
+INPUT_SHAPE = (1, 320, 320, 3)
+ITERATIONS = 500
+
+
+# Original object_detection.run preprocessing: blob (NCHW), transpose back to NHWC, cast,
+# then reconstruct a BGR image for display
+def blob_preprocessing(frame, input_dtype):
+    if input_dtype != np.uint8:
+        input_data = cv2.dnn.blobFromImage(image=frame, scalefactor=1/255.0, size=INPUT_SHAPE[1:3], swapRB=True, crop=True)
+        input_data = np.transpose(input_data, (0, 2, 3, 1)).astype(input_dtype)
+    else:
+        input_data = cv2.dnn.blobFromImage(image=frame, scalefactor=1, size=INPUT_SHAPE[1:3], swapRB=True, crop=True)
+        input_data = np.transpose(input_data, (0, 2, 3, 1)).astype(np.uint8)
+    input_reconstructed = cv2.cvtColor(input_data[0], cv2.COLOR_RGB2BGR)
+    return input_data, input_reconstructed
+
+def measure(function, frames):
+    # Return the mean time per call in milliseconds
+    for frame in frames[:10]:
+        function(frame)
+    start = time.perf_counter()
+    for i in range(ITERATIONS):
+        function(frames[i % len(frames)])
+    return (time.perf_counter() - start) / ITERATIONS * 1000
+
+
+if __name__ == "__main__":
+    cv2.setNumThreads(1)
+    frames = [np.random.randint(0, 256, FRAME_SHAPE, dtype=np.uint8) for _ in range(8)]
+
+    print(f"Preprocessing {FRAME_SHAPE[1]}x{FRAME_SHAPE[0]} frames for a {INPUT_SHAPE[2]}x{INPUT_SHAPE[1]} model input ({ITERATIONS} iterations)\n")
+    for input_dtype in (np.float32, np.uint8):
+        input_buffer = np.empty(INPUT_SHAPE, dtype=input_dtype)
+        preprocessor = Preprocessor(input_buffer)
+        blob_time = measure(lambda frame: blob_preprocessing(frame, input_dtype), frames)
+        buffer_time = measure(preprocessor, frames)
+        print(f"{np.dtype(input_dtype).name:>8}: blobFromImage path {blob_time:.3f} ms, "
+              f"preallocated path {buffer_time:.3f} ms ({blob_time / buffer_time:.1f}x faster)")
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import random
+import string
+
+# Make the src package importable when running from the scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src import qr_payload
+
+FUZZ_CASES = 200000
+BENCHMARK_SCANS = 1000000
+DISTINCT_CONTAINERS = 500
+
+VALID_PAYLOAD = "https://wearecauli.test-app.link/container-0001-8295f584-f45d-490c-5466-2654a546"
+
+
+# Original qr_code.process, used as the reference (it raises on some malformed payloads)
+def reference_process(string):
+    splits = string.split('/')
+    if (splits[-2] is None) or (splits[-2] != "wearecauli.test-app.link"):
+        return None
+    
+    data = splits[-1]
+    fields = data.split('-')
+    if len(fields) != 7:
+        return None
+    if (fields[0] is None) or (fields[0] != "container"):
+        return None
+    
+    type = qr_payload.TYPES.get(int(fields[1]), "unknown")
+    if type == "unknown":
+        return None
+    id = fields[2]
+    for f in fields[3:]:
+        id = id + '-' + f
+
+    return {'type': type, 'id': id}
+
+def reference_or_none(string):
+    try:
+        return reference_process(string)
+    except (IndexError, ValueError):
+        return None
+
+def random_payload(rng):
+    # Valid payloads, and mutations of them that exercise every field of the grammar
+    alphabet = string.hexdigits.lower() + '-/ +_\n.'
+    kind = rng.random()
+    if kind < 0.2:
+        return ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+    fields = ['container', rng.choice(['0', '1', '0001', '2', ' 1', '+1', '1_0', '', 'x', '١']),
+              *(''.join(rng.choice(string.hexdigits.lower()) for _ in range(rng.choice([0, 4, 8, 12]))) for _ in range(rng.choice([4, 5, 5, 5, 6])))]
+    if rng.random() < 0.1:
+        fields[0] = rng.choice(['Container', 'box', ''])
+    prefix = rng.choice(['https://', 'http://', '', 'https://x/', '/'])
+    host = rng.choice([qr_payload.PAYLOAD_HOST, qr_payload.PAYLOAD_HOST, 'example.com', ''])
+    payload = prefix + host + '/' + '-'.join(fields)
+    if rng.random() < 0.1:
+        position = rng.randint(0, len(payload))
+        payload = payload[:position] + rng.choice(alphabet) + payload[position:]
+    return payload
+
+def fuzz(cases):
+    # The parser must agree with the original implementation wherever the latter does not raise
+    rng = random.Random(0)
+    valid = 0
+    for _ in range(cases):
+        payload = random_payload(rng)
+        expected = reference_or_none(payload)
+        result = qr_payload.process(payload)
+        assert result == expected, f"{payload!r}: expected {expected}, got {result}"
+        valid += (result is not None)
+    print(f"Fuzzed {cases} payloads against the original parser ({valid} valid): OK")
+
+def measure(function, payloads):
+    start = time.perf_counter()
+    function(payloads)
+    return (time.perf_counter() - start) / len(payloads) * 1e6
+
+
+if __name__ == "__main__":
+    fuzz(FUZZ_CASES)
+
+    # Scan log replay: many scans of a limited number of containers
+    rng = random.Random(1)
+    containers = [VALID_PAYLOAD.replace('8295f584', f'{i:08x}') for i in range(DISTINCT_CONTAINERS)]
+    scans = [rng.choice(containers) for _ in range(BENCHMARK_SCANS)]
+
+    reference_time = measure(lambda payloads: [reference_or_none(p) for p in payloads], scans)
+    qr_payload.clear_cache()
+    process_time = measure(lambda payloads: [qr_payload.process(p) for p in payloads], scans)
+    qr_payload.clear_cache()
+    batch_time = measure(qr_payload.process_many, scans)
+    print(f"\nParsing {BENCHMARK_SCANS} scans of {DISTINCT_CONTAINERS} containers:")
+    print(f"    original process: {reference_time:.3f} us/scan")
+    print(f"      cached process: {process_time:.3f} us/scan ({reference_time / process_time:.1f}x faster)")
+    print(f"        process_many: {batch_time:.3f} us/scan ({reference_time / batch_time:.1f}x faster)")
+    print(f"    {qr_payload.cache_info()}")
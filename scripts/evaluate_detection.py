@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import logging
+import argparse
+
+# Make the src package importable when running from the scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src import batch_detection, object_detection
+
+
+# Run the object detection model over a dataset of frames (a directory of images or a video) and
+# compute its precision and recall against labels, at several confidence thresholds
+# The detections are saved (npz, one column per field) and can be evaluated again without running
+# the model, e.g. with other labels, thresholds or IoU
+#
+# Examples: python scripts/evaluate_detection.py dataset/frames --labels dataset/labels.csv \
+#               --output data/detections.npz
+#           python scripts/evaluate_detection.py data/detections.npz --labels dataset/labels.csv \
+#               --thresholds 0.2,0.3,0.4,0.5
+
+
+def print_report(report):
+    print(f"\n{'class':<8}{'threshold':>10}{'tp':>7}{'fp':>7}{'fn':>7}{'precision':>11}{'recall':>8}"
+          f"{'frame precision':>17}{'frame recall':>14}")
+    def percentage(value):
+        return 'n/a' if value is None else f'{value * 100:.1f}%'
+    for row in report:
+        print(f"{row['class']:<8}{row['threshold']:>10.2f}{row['tp']:>7}{row['fp']:>7}{row['fn']:>7}"
+              f"{percentage(row['precision']):>11}{percentage(row['recall']):>8}"
+              f"{percentage(row['frame_precision']):>17}{percentage(row['frame_recall']):>14}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the object detection model over a dataset of frames.")
+    parser.add_argument('source', help='directory of images, video file, or detections (.npz) of an earlier run')
+    parser.add_argument('--labels', default=None, help='CSV of "frame,class,x,y,width,height" rows (pixels)')
+    parser.add_argument('--model', default=object_detection.MODEL_PATH, help='TFLite model')
+    parser.add_argument('--output', default='./data/detections.npz', help='detections file to write')
+    parser.add_argument('--report', default=None, help='JSON file to write the precision/recall table to')
+    parser.add_argument('--interpreters', type=int, default=batch_detection.NUM_INTERPRETERS, help='inference worker processes')
+    parser.add_argument('--threads', type=int, default=batch_detection.THREADS_PER_INTERPRETER, help='threads per interpreter')
+    parser.add_argument('--prefetch', type=int, default=batch_detection.PREFETCH, help='decoded frames waiting for an interpreter')
+    parser.add_argument('--decode-workers', type=int, default=batch_detection.DECODE_WORKERS, help='threads decoding images')
+    parser.add_argument('--min-score', type=float, default=batch_detection.MIN_SCORE, help='lowest confidence kept')
+    parser.add_argument('--thresholds', default=','.join(str(t) for t in batch_detection.THRESHOLDS), help='confidence thresholds to evaluate')
+    parser.add_argument('--iou', type=float, default=batch_detection.IOU_THRESHOLD, help='IoU for a detection to match a label')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s: %(message)s')
+
+    if args.source.endswith('.npz'):
+        columns = batch_detection.load(args.source)
+    else:
+        if not os.path.exists(args.source):
+            parser.error(f'{args.source} does not exist')
+        columns = batch_detection.detect_all(args.source, args.model, args.interpreters, args.threads,
+                                             args.prefetch, args.decode_workers, args.min_score)
+        batch_detection.save(args.output, columns)
+        frames = len(columns['names'])
+        print(f"{frames} frames, {len(columns['score'])} detections in {float(columns['duration']):.1f}s "
+              f"({frames / max(float(columns['duration']), 1e-9):.1f} frames/s); saved to {args.output}")
+
+    if args.labels:
+        thresholds = [float(t) for t in args.thresholds.split(',')]
+        report = batch_detection.evaluate(columns, batch_detection.load_labels(args.labels), thresholds, args.iou)
+        print_report(report)
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump({'model_path': str(columns['model_path']), 'iou': args.iou, 'report': report}, f, indent=2)
@@ -0,0 +1,29 @@
+import os
+import sys
+import argparse
+
+# Make the src package importable when running from the scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src import journal
+
+
+# Export the collection journal in the original CSV format (collections and unsent backlog), by
+# default next to the legacy files rather than over them
+# Run it while the machine is stopped: opening the journal recovers it (truncating a torn tail)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the collection journal to CSV.")
+    parser.add_argument('--journal', default=journal.JOURNAL_PATH, help='journal path')
+    parser.add_argument('--records', default=journal.EXPORT_RECORDS_PATH, help='collections CSV output')
+    parser.add_argument('--backlog', default=journal.EXPORT_BACKLOG_PATH, help='unsent confirmations CSV output')
+    parser.add_argument('--compact', action='store_true', help='also drop the sent confirmations from the journal')
+    args = parser.parse_args()
+
+    collection_journal = journal.Journal(args.journal)
+    collection_journal.export_csv(args.records, args.backlog)
+    print(f"Exported {len(collection_journal.records(journal.COLLECTION))} collections and "
+          f"{len(collection_journal.pending())} unsent confirmations")
+    if args.compact:
+        print(f"Compaction reclaimed {collection_journal.compact()} bytes")
+    collection_journal.close()
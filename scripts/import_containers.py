@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+import csv
+import argparse
+
+# Make the src package importable when running from the scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src import registry
+
+
+# Bulk import of issued container IDs into the local registry
+# Each CSV file has one "type,id" row per container (e.g. "cup,8295f584-f45d-490c-5466-2654a546")
+# With --remove, the rows of the files are withdrawn from the registry instead
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import issued container IDs into the local registry.")
+    parser.add_argument('files', nargs='+', help='CSV files of "type,id" rows')
+    parser.add_argument('--registry', default=registry.REGISTRY_PATH, help='registry database path')
+    parser.add_argument('--remove', action='store_true', help='withdraw the containers instead of adding them')
+    parser.add_argument('--version', default=None, help='registry version reached once the files are applied')
+    args = parser.parse_args()
+
+    container_registry = registry.ContainerRegistry(args.registry)
+    start = time.perf_counter()
+    for path in args.files:
+        if args.remove:
+            with open(path, newline='') as f:
+                rows = [row for row in csv.reader(f) if len(row) >= 2]
+            _, count = container_registry.apply_delta(removed=rows)
+            print(f"{path}: {count} containers removed")
+        else:
+            count = container_registry.import_csv(path)
+            print(f"{path}: {count} new containers")
+    if args.version is not None:
+        container_registry.apply_delta(version=args.version)
+    print(f"Done in {time.perf_counter() - start:.1f}s: {container_registry.count('box')} boxes, "
+          f"{container_registry.count('cup')} cups (version {container_registry.version()})")
+    container_registry.close()
@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# Make the src package importable when running from the scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src.display import SHM_PREFIX, SHM_HEADER
+
+# Display the windows published by main.py when it runs with the "shm" display sink
+# Usage: python3 preview.py [window names...]
+WINDOW_NAMES = ['centerFrameWithContours', 'colorMaskedCenterFrame', 'detectionFrame', 'detections', 'Tracking Box']
+
+
+def attach(name):
+    try:
+        segment = shared_memory.SharedMemory(name=SHM_PREFIX + name.replace(' ', '_'))
+    except FileNotFoundError:
+        return None
+    # The segment belongs to main.py: do not unlink it when this viewer exits
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or WINDOW_NAMES
+    segments = {}
+    counters = {}
+
+    print("Waiting for frames, press [q] to quit.")
+    while(True):
+        for name in names:
+            if name not in segments:
+                segment = attach(name)
+                if segment is None:
+                    continue
+                segments[name] = segment
+            buf = segments[name].buf
+            counter, height, width, channels = SHM_HEADER.unpack_from(buf, 0)
+            if counter == counters.get(name, 0):
+                continue
+            counters[name] = counter
+            shape = (height, width) if channels == 1 else (height, width, channels)
+            image = np.ndarray(shape, dtype=np.uint8, buffer=buf, offset=SHM_HEADER.size).copy()
+            cv2.imshow(name, image)
+
+        if cv2.waitKey(20) & 0xFF == ord('q'):
+            break
+        time.sleep(0.01)
+
+    for segment in segments.values():
+        segment.close()
+    cv2.destroyAllWindows()
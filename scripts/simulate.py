@@ -0,0 +1,49 @@
+import os
+import sys
+import argparse
+
+# Make the src package (and main.py) importable when running from the scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+# Run the full collection loop without any hardware: the cameras replay recordings (video files
+# or directories of frames), the load cells follow a scripted weight trace, and the GPIO, LEDs and
+# iris servo do nothing
+# Run it from the repository root (models and data are found relative to it); collections are
+# recorded in ./data as usual
+#
+# Example: python scripts/simulate.py --side recordings/side.mp4 --top recordings/top.mp4 \
+#              --weights 0:0,1.5:45,7:0 --period 10 --speed 0 --cycles 20
+
+
+def parse_weights(text):
+    # "t1:grams1,t2:grams2,..." -> [(t1, grams1), (t2, grams2), ...]
+    steps = []
+    for step in text.split(','):
+        time, weight = step.split(':')
+        steps.append((float(time), float(weight)))
+    return steps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the collection loop on recordings, without hardware.")
+    parser.add_argument('--side', required=True, help='recording of the side camera (video file or frame directory)')
+    parser.add_argument('--top', required=True, help='recording of the top camera (video file or frame directory)')
+    parser.add_argument('--fps', type=float, default=None, help='frame rate of the recordings (default: from the video files)')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed (1: real time, 0: as fast as possible)')
+    parser.add_argument('--weights', default='0:0', help='load cell trace, as "time:grams" steps (seconds from the start)')
+    parser.add_argument('--period', type=float, default=None, help='period of the load cell trace (seconds), to repeat it')
+    parser.add_argument('--sleep-scale', type=float, default=0.0, help='scale of the fixed pauses (LED animations, error pauses)')
+    parser.add_argument('--cycles', type=int, default=None, help='number of collection cycles to run (default: forever)')
+    parser.add_argument('--display', default='none', help='debug sink: none, window, mjpeg or shm')
+    args = parser.parse_args()
+
+    os.environ['CAULI_DISPLAY'] = args.display
+    from src import hardware
+    hardware.configure(simulation=True, speed=args.speed, sleep_scale=args.sleep_scale, fps=args.fps,
+                       load_cell_trace=hardware.LoadCellTrace(parse_weights(args.weights), loop_period=args.period))
+
+    import main
+    hardware.configure(recordings={main.SIDE_CAMERA_ID: args.side, main.TOP_CAMERA_ID: args.top})
+    main.main(max_cycles=args.cycles)
+    print(f"{main.metrics.counters().get('cycles', 0)} cycles simulated")
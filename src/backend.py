@@ -1,5 +1,11 @@
 import time
-import csv
+import logging
+import threading
+import collections
+
+from . import registry
+from . import journal
+from . import backend_client
 
 
 ONLINE = False
@@ -7,20 +13,78 @@ ONLINE = False
 RECORDS_PATH = './data/collections.csv'
 BACKLOG_PATH = './data/backlog.csv'
 
-VALID_BOX_IDS = []
-VALID_CUP_IDS = ['8295f584-f45d-490c-5466-2654a546', '8288f584-dd6f-490c-8137-2b85f49ff488']
-
-
-def check_container(container):
-    c_type = container.get('type', 'error')
-    c_id = container.get('id', 'error')
-    
+CONTAINER_TYPES = ('box', 'cup')
+
+# Validity decisions are cached: valid containers for VALID_TTL seconds, invalid ones for
+# INVALID_TTL seconds (so that a newly issued container is soon accepted), at most CACHE_SIZE of them
+VALID_TTL = 300.0
+INVALID_TTL = 30.0
+CACHE_SIZE = 1024
+
+
+class ValidityCache:
+    # LRU cache of validity decisions, with a different time-to-live for valid and invalid containers
+
+    def __init__(self, size=CACHE_SIZE, valid_ttl=VALID_TTL, invalid_ttl=INVALID_TTL):
+        self.size = size
+        self.valid_ttl = valid_ttl
+        self.invalid_ttl = invalid_ttl
+        self._entries = collections.OrderedDict()   # (type, id) -> (valid, expiry time)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        # Cached decision, or None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() < entry[1]:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, valid):
+        ttl = self.valid_ttl if valid else self.invalid_ttl
+        with self._lock:
+            self._entries[key] = (valid, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': (self.hits / lookups) if lookups else 0.0,
+                    'expirations': self.expirations, 'evictions': self.evictions,
+                    'invalidations': self.invalidations, 'size': len(self._entries)}
+
+
+validity_cache = ValidityCache()
+
+
+def _check_container(c_type, c_id):
     if not ONLINE:
-        # Basic checks against locally known ids (temporary)
-        if c_type == 'box':
-            return (c_id in VALID_BOX_IDS)
-        elif c_type == 'cup':
-            return (c_id in VALID_CUP_IDS)
+        # Check against the local registry of issued containers
+        if c_type in CONTAINER_TYPES:
+            return registry.get().contains(c_type, c_id)
     
     else:
         # Send validity request to Cauli API
@@ -29,6 +93,24 @@ def check_container(container):
     return False
 
 
+def check_container(container):
+    c_type = container.get('type', 'error')
+    c_id = container.get('id', 'error')
+
+    # The same container is checked again on every retry: only the first check goes to the source
+    key = (c_type, c_id)
+    valid = validity_cache.get(key)
+    if valid is None:
+        valid = _check_container(c_type, c_id)
+        validity_cache.put(key, valid)
+    return valid
+
+
+def _journal():
+    # The CSV files of earlier versions are imported when the journal is created
+    return journal.get(legacy_records_path=RECORDS_PATH, legacy_backlog_path=BACKLOG_PATH)
+
+
 def record_collection(container, status):
 
     c_type = container.get('type', 'error')
@@ -36,10 +118,7 @@ def record_collection(container, status):
     timestamp = time.time()
 
     # Append to collection records
-    with open(RECORDS_PATH, 'a') as f:
-        writer = csv.writer(f)
-        writer.writerow([timestamp, c_type, c_id, status])
-        f.close()
+    _journal().append_collection(timestamp, c_type, c_id, status)
 
     return (c_type != 'error' and c_id != 'error')
 
@@ -50,18 +129,31 @@ def send_collection_confirmation(container):
     c_id = container.get('id', 'error')
     timestamp = time.time()
 
-    if not ONLINE:
-        # Append to collection backlog (to be sent later)
-        with open(BACKLOG_PATH, 'a') as f:
-            writer = csv.writer(f)
-            writer.writerow([timestamp, c_type, c_id])
-            f.close()
-    
+    # Append to collection backlog (to be sent later): confirmations stay in the journal until the
+    # backend has accepted them
+    def append():
+        return _journal().append_confirmation(timestamp, c_type, c_id)
+
+    if ONLINE:
+        # Append and queue the confirmation through the background client, which sends it with the
+        # others and flushes the backlog
+        backend_client.get(journal=_journal()).submit(append)
     else:
-        # 1. Send to Cauli API
-        # 2. Send all pending collections in backlog
-        # 3. Empty backlog
-        # If something fails, put everything back in backlog
-        pass
+        append()
+
+    # The container is collected: a cached decision must not let it be collected again
+    validity_cache.invalidate((c_type, c_id))
+
+    return (c_type != 'error' and c_id != 'error')
+
+
+def export_csv(records_path=journal.EXPORT_RECORDS_PATH, backlog_path=journal.EXPORT_BACKLOG_PATH):
+    # Write the journal in the original CSV format (by default next to the legacy files)
+    _journal().export_csv(records_path, backlog_path)
+
 
-    return (c_type != 'error' and c_id != 'error')
\ No newline at end of file
+def close():
+    # Send what the background client still has queued, then commit the journal
+    logging.info(f'Validity cache: {validity_cache.stats()}')
+    backend_client.stop()
+    journal.close()
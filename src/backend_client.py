@@ -0,0 +1,286 @@
+# Import libraries
+import os
+import json
+import random
+import asyncio
+import logging
+import threading
+from urllib.parse import urlsplit
+
+
+BACKEND_URL = os.environ.get('CAULI_BACKEND_URL', 'http://127.0.0.1:8080')
+COLLECTIONS_PATH = '/collections'
+
+POOL_SIZE = 2                   # keep-alive connections to the backend
+QUEUE_SIZE = 256                # confirmations waiting to be sent; beyond that they are left to the backlog flush
+BATCH_SIZE = 32                 # confirmations per request
+BATCH_WAIT = 0.5                # time to wait for more confirmations before sending a batch (seconds)
+REQUEST_TIMEOUT = 5.0
+RETRY_DELAY = 0.5               # first retry delay, doubled after each failure (seconds)
+RETRY_MAX_DELAY = 30.0
+MAX_ATTEMPTS = 5                # a batch that still fails is left to the backlog flush
+BACKLOG_FLUSH_INTERVAL = 60.0   # seconds between two attempts to flush the backlog
+
+
+class BackendError(Exception):
+    pass
+
+
+class ConnectionPool:
+    # Minimal HTTP/1.1 client over a pool of keep-alive asyncio connections
+
+    def __init__(self, url, size=POOL_SIZE, timeout=REQUEST_TIMEOUT):
+        parts = urlsplit(url)
+        if parts.scheme != 'http':
+            raise ValueError(f'Unsupported backend URL "{url}": only http:// is supported')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []
+
+    async def _connect(self):
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+
+    async def _exchange(self, connection, method, path, body):
+        reader, writer = connection
+        headers = (f'{method} {self.prefix}{path} HTTP/1.1\r\n'
+                   f'Host: {self.host}:{self.port}\r\n'
+                   f'Content-Type: application/json\r\n'
+                   f'Content-Length: {len(body)}\r\n'
+                   f'Connection: keep-alive\r\n\r\n')
+        writer.write(headers.encode('ascii') + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('Connection closed by the backend')
+        status = int(status_line.split()[1])
+        length = 0
+        keep_alive = True
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection' and value.strip().lower() == 'close':
+                keep_alive = False
+        payload = await reader.readexactly(length) if length else b''
+        return status, payload, keep_alive
+
+    async def request(self, method, path, data=None):
+        # Send a JSON request and return (status, decoded JSON body or None)
+        body = b'' if data is None else json.dumps(data).encode('utf-8')
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else await self._connect()
+            try:
+                status, payload, keep_alive = await asyncio.wait_for(self._exchange(connection, method, path, body), self.timeout)
+            except BaseException:
+                connection[1].close()
+                raise
+            if keep_alive:
+                self._idle.append(connection)
+            else:
+                connection[1].close()
+        return status, (json.loads(payload) if payload else None)
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+class BackendClient:
+    # Sends collection confirmations from a background asyncio loop, so that the collection path
+    # never waits for the network: submit() only queues a confirmation
+    # Confirmations are journal records, written as they are submitted: they are only
+    # acknowledged in the journal once the backend accepted them, and the ones that could not be
+    # queued or sent are flushed from the journal in the background
+
+    def __init__(self, url=BACKEND_URL, journal=None, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE,
+                 batch_wait=BATCH_WAIT, flush_interval=BACKLOG_FLUSH_INTERVAL):
+        self.url = url
+        self.journal = journal
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.flush_interval = flush_interval
+        self.stats = {'sent': 0, 'failed_requests': 0, 'backlogged': 0, 'flushed': 0}
+        # seqs of the confirmations queued or being sent, which the backlog flush must skip
+        self._outstanding = set()
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='BackendClient', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self.pool = ConnectionPool(self.url)
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [self._loop.create_task(self._send_loop()),
+                       self._loop.create_task(self._flush_loop())]
+        self._ready.set()
+        self._loop.run_forever()
+        self.pool.close()
+        self._loop.close()
+
+    def submit(self, append):
+        # Write a confirmation to the journal with `append` (which returns its record), and queue it
+        # without waiting for the network
+        # Both happen in one step of the loop, which also runs the backlog flush: the flush never
+        # sees a confirmation that is about to be queued, so it is never sent twice
+        # Returns False if it could not be queued: it stays in the journal backlog
+        if not self._thread.is_alive():
+            append()
+            return False
+        result = threading.Event()
+        outcome = {}
+        def enqueue():
+            try:
+                record = append()
+                try:
+                    self.queue.put_nowait(record)
+                    self._outstanding.add(record.seq)
+                    outcome['accepted'] = True
+                except asyncio.QueueFull:
+                    self.stats['backlogged'] += 1
+            except Exception as e:
+                outcome['error'] = e
+            finally:
+                result.set()
+        self._loop.call_soon_threadsafe(enqueue)
+        result.wait()
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('accepted', False)
+
+    async def _next_batch(self):
+        # Wait for a confirmation, then gather more for up to batch_wait seconds
+        batch = [await self.queue.get()]
+        deadline = self._loop.time() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _post(self, batch):
+        collections = [{'timestamp': r.timestamp, 'type': r.type, 'id': r.id} for r in batch]
+        status, _ = await self.pool.request('POST', COLLECTIONS_PATH, {'collections': collections})
+        if not (200 <= status < 300):
+            raise BackendError(f'Backend answered with status {status}')
+
+    async def _send(self, batch, attempts=MAX_ATTEMPTS):
+        # Send a batch, retrying with exponential backoff (with jitter); returns whether it was sent
+        delay = RETRY_DELAY
+        for attempt in range(attempts):
+            try:
+                await self._post(batch)
+                return True
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, BackendError) as e:
+                self.stats['failed_requests'] += 1
+                logging.warning(f'Sending {len(batch)} confirmations failed (attempt {attempt + 1}/{attempts}): {e!r}')
+                if attempt + 1 < attempts:
+                    await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                    delay = min(delay * 2, RETRY_MAX_DELAY)
+        return False
+
+    def _acknowledge(self, batch):
+        if self.journal is not None:
+            self.journal.acknowledge([record.seq for record in batch])
+
+    async def _send_loop(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                sent = await self._send(batch)
+                if sent:
+                    await self._loop.run_in_executor(None, self._acknowledge, batch)
+            except Exception:
+                # e.g. the journal could not be written: keep the loop alive, the confirmations
+                # are still unsent in the journal and the flush sends them again
+                logging.exception(f'Sending {len(batch)} confirmations failed.')
+                sent = False
+            finally:
+                # Either way the confirmations are in the journal: unsent ones will be flushed later
+                # (sent ones stay outstanding until acknowledged, so the flush does not send them again)
+                self._outstanding.difference_update(record.seq for record in batch)
+            if sent:
+                self.stats['sent'] += len(batch)
+            else:
+                self.stats['backlogged'] += len(batch)
+
+    async def flush_backlog(self):
+        # Send the unsent confirmations of the journal in batches, stopping at the first failure
+        if self.journal is None:
+            return True
+        flushed = 0
+        while True:
+            batch = self.journal.pending(limit=self.batch_size, exclude=self._outstanding)
+            if not batch:
+                break
+            if not await self._send(batch, attempts=1):
+                return False
+            await self._loop.run_in_executor(None, self._acknowledge, batch)
+            flushed += len(batch)
+            self.stats['flushed'] += len(batch)
+        if flushed:
+            logging.info(f'Flushed {flushed} confirmations from the backlog.')
+        return True
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await self.flush_backlog()
+            except Exception:
+                logging.exception('Flushing the backlog failed.')
+            await asyncio.sleep(self.flush_interval)
+
+    def pending(self):
+        # Number of confirmations waiting to be sent
+        return self.queue.qsize()
+
+    def stop(self, timeout=REQUEST_TIMEOUT):
+        # Give the queued confirmations a chance to be sent (the rest stays in the journal)
+        if not self._thread.is_alive():
+            return
+        async def drain():
+            end = self._loop.time() + timeout
+            while self._outstanding and self._loop.time() < end:
+                await asyncio.sleep(0.05)
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        asyncio.run_coroutine_threadsafe(drain(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get(url=BACKEND_URL, journal=None):
+    # Return the shared client, starting it on first use
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = BackendClient(url, journal=journal)
+        return _client
+
+
+def stop():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.stop()
+            _client = None
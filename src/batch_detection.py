@@ -0,0 +1,287 @@
+# Import libraries
+import os
+import csv
+import time
+import queue
+import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+from . import boxes
+from . import inference
+from . import preprocessing
+from . import object_detection
+from .hardware import IMAGE_EXTENSIONS
+
+
+# Offline object detection over datasets of frames (directories of images, or videos), for
+# retraining and threshold tuning: the frames are decoded ahead by a prefetching pipeline and
+# spread over a pool of interpreters (one inference worker process each)
+
+NUM_INTERPRETERS = 2
+THREADS_PER_INTERPRETER = 2
+# Decoded frames waiting for an interpreter
+PREFETCH = 16
+DECODE_WORKERS = 2
+# Detections below this confidence are not kept: the thresholds are applied at evaluation time
+MIN_SCORE = 0.05
+IOU_THRESHOLD = 0.5
+THRESHOLDS = (0.3, 0.4, 0.5, 0.6, 0.7, 0.8)
+
+
+class FramePrefetcher(threading.Thread):
+    # Decode the frames of a directory (several images at once) or of a video into a bounded queue
+    # of (index, name, frame); `consumers` None markers are queued at the end
+
+    def __init__(self, source, depth=PREFETCH, decode_workers=DECODE_WORKERS, consumers=1):
+        super().__init__(name='FramePrefetcher', daemon=True)
+        self.source = source
+        self.queue = queue.Queue(maxsize=depth)
+        self.depth = depth
+        self.decode_workers = decode_workers
+        self.consumers = consumers
+        self.skipped = []
+        self._stop_event = threading.Event()
+
+    def _put(self, item):
+        while not self._stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _directory_frames(self):
+        names = sorted(f for f in os.listdir(self.source) if f.lower().endswith(IMAGE_EXTENSIONS))
+        # cv2.imread releases the GIL: keep up to `depth` images decoding, and hand them out in order
+        with ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix='decode') as executor:
+            pending = collections.deque()
+            for name in names:
+                pending.append((name, executor.submit(cv2.imread, os.path.join(self.source, name))))
+                if len(pending) >= self.depth:
+                    name, future = pending.popleft()
+                    yield name, future.result()
+            while pending:
+                name, future = pending.popleft()
+                yield name, future.result()
+
+    def _video_frames(self):
+        video = cv2.VideoCapture(self.source)
+        if not video.isOpened():
+            raise ValueError(f'Could not open {self.source}')
+        try:
+            index = 0
+            while True:
+                success, frame = video.read()
+                if not success:
+                    return
+                yield f'{index:06d}', frame
+                index += 1
+        finally:
+            video.release()
+
+    def run(self):
+        try:
+            frames = self._directory_frames() if os.path.isdir(self.source) else self._video_frames()
+            index = 0
+            for name, frame in frames:
+                if frame is None:
+                    logging.warning(f'Could not decode frame {name} of {self.source}: skipped.')
+                    self.skipped.append(name)
+                    continue
+                if not self._put((index, name, frame)):
+                    return
+                index += 1
+        finally:
+            for _ in range(self.consumers):
+                self._put(None)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=2.0)
+
+
+class InterpreterPool:
+    # Several inference workers, each fed by its own thread: a frame is preprocessed straight into
+    # the shared input buffer of a free worker, as in object_detection.run
+
+    def __init__(self, model_path, size=NUM_INTERPRETERS, num_threads=THREADS_PER_INTERPRETER):
+        # The workers are forked: create the pool before starting any other thread
+        self.services = []
+        try:
+            for _ in range(size):
+                self.services.append(inference.InferenceService(model_path, num_threads=num_threads))
+        except Exception:
+            self.stop()
+            raise
+        self.input_shape = tuple(self.services[0].input_shape)
+
+    def _consume(self, service, frames, results, errors, min_score):
+        preprocessor = preprocessing.Preprocessor(service.input_buffer, preprocessing.quantization(service.input_details[0]))
+        while True:
+            item = frames.get()
+            if item is None:
+                return
+            index, name, frame = item
+            try:
+                preprocessor(frame)
+                output, latency = service.infer()
+            except Exception as e:
+                errors.append((name, e))
+                return
+            detections = object_detection.parse_detections(output, min_score)
+            results.append((index, name, frame.shape[:2], latency, detections))
+
+    def run(self, frames, min_score=MIN_SCORE):
+        # Detect objects in every frame of the `frames` queue (one None marker per worker ends it)
+        # Returns the (index, name, frame shape, latency, detections) of every frame, in order
+        results = []
+        errors = []
+        threads = [threading.Thread(target=self._consume, args=(service, frames, results, errors, min_score),
+                                    name=f'BatchInference-{i}', daemon=True)
+                   for i, service in enumerate(self.services)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            name, error = errors[0]
+            raise RuntimeError(f'Detection failed on frame {name}: {error}') from error
+        return sorted(results, key=lambda result: result[0])
+
+    def stop(self):
+        for service in self.services:
+            service.stop()
+        self.services = []
+
+
+def detect_all(source, model_path=object_detection.MODEL_PATH, interpreters=NUM_INTERPRETERS,
+               threads=THREADS_PER_INTERPRETER, prefetch=PREFETCH, decode_workers=DECODE_WORKERS, min_score=MIN_SCORE):
+    # Run the model over every frame of `source` (directory of images or video file)
+    # Returns the detections as columns (see to_columns)
+    pool = InterpreterPool(model_path, interpreters, threads)
+    prefetcher = FramePrefetcher(source, prefetch, decode_workers, consumers=interpreters)
+    start = time.monotonic()
+    prefetcher.start()
+    try:
+        results = pool.run(prefetcher.queue, min_score)
+    finally:
+        prefetcher.stop()
+        pool.stop()
+    duration = time.monotonic() - start
+    logging.info(f'Detected objects in {len(results)} frames of {source} in {duration:.1f}s '
+                 f'({len(results) / max(duration, 1e-9):.1f} frames/s, {interpreters} interpreters).')
+    columns = to_columns(results, pool.input_shape)
+    columns['model_path'] = np.array(model_path)
+    columns['min_score'] = np.array(min_score)
+    columns['duration'] = np.array(duration)
+    return columns
+
+
+def to_columns(results, input_shape):
+    # Columnar layout: one row per frame (names, shapes, latencies) and one row per detection
+    # (frame, class_id, score, box relative to the model input, bbox (x, y, width, height) in
+    # pixels of the original frame)
+    detection_rows = [(i, detection, shape) for i, (_, _, shape, _, detections) in enumerate(results)
+                      for detection in detections]
+    return {
+        'names': np.array([name for _, name, _, _, _ in results], dtype=str),
+        'shapes': np.array([shape for _, _, shape, _, _ in results], dtype=np.int32).reshape(-1, 2),
+        'latencies': np.array([latency for _, _, _, latency, _ in results], dtype=np.float32),
+        'frame': np.array([i for i, _, _ in detection_rows], dtype=np.int32),
+        'class_id': np.array([d['class_id'] for _, d, _ in detection_rows], dtype=np.int16),
+        'score': np.array([d['confidence'] for _, d, _ in detection_rows], dtype=np.float32),
+        'box': np.array([d['box'] for _, d, _ in detection_rows], dtype=np.float32).reshape(-1, 4),
+        'bbox': np.array([object_detection.convert_bbox(d['box'], shape, input_shape) for _, d, shape in detection_rows],
+                         dtype=np.int32).reshape(-1, 4),
+    }
+
+def save(path, columns):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    np.savez_compressed(path, **columns)
+
+def load(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def load_labels(path):
+    # CSV rows of "frame,class,x,y,width,height" (boxes in pixels of the original frame); a row with
+    # an empty class marks a frame without any object; frames missing from the file are not evaluated
+    labels = {}
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or row[0] == 'frame':
+                continue
+            name, class_name = row[0], row[1].strip() if len(row) > 1 else ''
+            objects = labels.setdefault(name, [])
+            if class_name:
+                objects.append((class_name, tuple(float(v) for v in row[2:6])))
+    return labels
+
+def _match(columns, labels, class_id, class_name, iou_threshold):
+    # Greedy matching of the detections of a class with the labels, by decreasing confidence
+    # A detection only competes with the more confident ones, so matching once at the lowest
+    # confidence gives the result at every threshold
+    index = {name: i for i, name in enumerate(columns['names'])}
+    selected = np.flatnonzero(columns['class_id'] == class_id)
+    selected = selected[np.argsort(-columns['score'][selected], kind='stable')]
+    by_frame = collections.defaultdict(list)
+    for i in selected:
+        by_frame[int(columns['frame'][i])].append(i)
+
+    scores, matched, frame_scores, frame_positive = [], [], [], []
+    label_count = 0
+    for name, objects in labels.items():
+        truth = boxes.to_array([box for label, box in objects if label == class_name])
+        label_count += len(truth)
+        detections = by_frame.get(index.get(name, -1), [])
+        frame_positive.append(len(truth) > 0)
+        frame_scores.append(max((columns['score'][i] for i in detections), default=0.0))
+        taken = np.zeros(len(truth), dtype=bool)
+        for i in detections:
+            scores.append(columns['score'][i])
+            if len(truth) == 0:
+                matched.append(False)
+                continue
+            overlaps = boxes.iou(columns['bbox'][i], truth)
+            overlaps[taken] = 0
+            best = int(np.argmax(overlaps))
+            matched.append(bool(overlaps[best] >= iou_threshold))
+            taken[best] |= matched[-1]
+    return (np.array(scores, dtype=np.float32), np.array(matched, dtype=bool), label_count,
+            np.array(frame_scores, dtype=np.float32), np.array(frame_positive, dtype=bool))
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator else None
+
+def evaluate(columns, labels, thresholds=THRESHOLDS, iou_threshold=IOU_THRESHOLD, class_labels=object_detection.CLASS_LABELS):
+    # Precision and recall at every threshold, for every class:
+    # - per object: a detection is correct if it overlaps an unmatched label of its class (IoU)
+    # - per frame: the frame contains the class, as decided by object_detection.run
+    names = set(columns['names'])
+    missing = [name for name in labels if name not in names]
+    if missing:
+        logging.warning(f'{len(missing)} labelled frames have no detection results (e.g. {missing[0]}).')
+    report = []
+    for class_id, class_name in enumerate(class_labels):
+        scores, matched, label_count, frame_scores, frame_positive = _match(columns, labels, class_id, class_name, iou_threshold)
+        for threshold in thresholds:
+            kept = scores >= threshold
+            tp = int(np.count_nonzero(matched & kept))
+            fp = int(np.count_nonzero(~matched & kept))
+            detected = frame_scores >= threshold
+            frame_tp = int(np.count_nonzero(detected & frame_positive))
+            frame_fp = int(np.count_nonzero(detected & ~frame_positive))
+            frame_fn = int(np.count_nonzero(~detected & frame_positive))
+            report.append({
+                'class': class_name, 'threshold': float(threshold),
+                'tp': tp, 'fp': fp, 'fn': label_count - tp,
+                'precision': _ratio(tp, tp + fp), 'recall': _ratio(tp, label_count),
+                'frame_precision': _ratio(frame_tp, frame_tp + frame_fp), 'frame_recall': _ratio(frame_tp, frame_tp + frame_fn),
+            })
+    return report
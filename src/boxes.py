@@ -0,0 +1,76 @@
+# Import libraries
+import numpy as np
+
+
+# Vectorized bounding box geometry
+# Boxes are (x, y, width, height), stored as arrays of shape (..., 4); single boxes and arrays of
+# boxes broadcast against each other, so that one call handles every box of a frame
+
+
+def to_array(boxes):
+    # Convert a box or a list of boxes to an (N, 4) float array
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+def to_tuple(box):
+    # Convert a single box back to a tuple of ints (the format used by OpenCV)
+    return tuple(int(round(v)) for v in np.asarray(box).reshape(4))
+
+def area(boxes):
+    boxes = np.asarray(boxes, dtype=np.float64)
+    return boxes[..., 2] * boxes[..., 3]
+
+def intersection(boxes1, boxes2):
+    # Intersection of each pair of boxes (zero width/height when they do not intersect)
+    boxes1 = np.asarray(boxes1, dtype=np.float64)
+    boxes2 = np.asarray(boxes2, dtype=np.float64)
+    # Find the top left corner
+    x1 = np.maximum(boxes1[..., 0], boxes2[..., 0])
+    y1 = np.maximum(boxes1[..., 1], boxes2[..., 1])
+    # Find the bottom right corner
+    x2 = np.minimum(boxes1[..., 0] + boxes1[..., 2], boxes2[..., 0] + boxes2[..., 2])
+    y2 = np.minimum(boxes1[..., 1] + boxes1[..., 3], boxes2[..., 1] + boxes2[..., 3])
+    return np.stack([x1, y1, np.maximum(x2 - x1, 0), np.maximum(y2 - y1, 0)], axis=-1)
+
+def intersection_area(boxes1, boxes2):
+    return area(intersection(boxes1, boxes2))
+
+def percentage_inside(overlapping_boxes, boxes):
+    # Fraction of the area of each overlapping box that is inside the corresponding box
+    overlapping_area = area(overlapping_boxes)
+    intersect_area = intersection_area(overlapping_boxes, boxes)
+    return np.divide(intersect_area, overlapping_area, out=np.zeros_like(intersect_area), where=(overlapping_area > 0))
+
+def iou(boxes1, boxes2):
+    # Intersection over union of each pair of boxes
+    intersect_area = intersection_area(boxes1, boxes2)
+    union_area = area(boxes1) + area(boxes2) - intersect_area
+    return np.divide(intersect_area, union_area, out=np.zeros_like(intersect_area), where=(union_area > 0))
+
+def pairwise(function, boxes1, boxes2):
+    # Apply a geometry function to every pair of an (N, 4) and an (M, 4) array: returns (N, M)
+    return function(to_array(boxes1)[:, None, :], to_array(boxes2)[None, :, :])
+
+def union(boxes):
+    # Find the bounding box that encompasses all the boxes
+    boxes = to_array(boxes)
+    # Find the top left corner
+    x1 = boxes[:, 0].min()
+    y1 = boxes[:, 1].min()
+    # Find the bottom right corner
+    x2 = (boxes[:, 0] + boxes[:, 2]).max()
+    y2 = (boxes[:, 1] + boxes[:, 3]).max()
+    return np.array([x1, y1, x2 - x1, y2 - y1])
+
+def center(boxes):
+    # (x, y) center of each box
+    boxes = np.asarray(boxes, dtype=np.float64)
+    return boxes[..., :2] + boxes[..., 2:] / 2
+
+def expand(boxes, expansion_factor):
+    # Expand boxes around their center by a certain factor
+    boxes = np.asarray(boxes, dtype=np.float64)
+    new_width = boxes[..., 2] * expansion_factor
+    new_height = boxes[..., 3] * expansion_factor
+    new_x = boxes[..., 0] + (boxes[..., 2] - new_width) / 2
+    new_y = boxes[..., 1] + (boxes[..., 3] - new_height) / 2
+    return np.stack([new_x, new_y, new_width, new_height], axis=-1)
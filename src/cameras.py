@@ -0,0 +1,208 @@
+# Import libraries
+import time
+import logging
+import threading
+import cv2
+import numpy as np
+
+# Also imported as a top-level module by the other modules' __main__ blocks
+if __package__:
+    from . import hardware
+else:
+    import hardware
+
+
+DEFAULT_RESOLUTION = (640, 480)
+DEFAULT_FPS = 15
+# Ask the cameras for compressed frames so that both of them can stream at the same time
+# without saturating the USB bandwidth (they are now kept open for the whole program)
+USE_MJPEG = True
+
+# Number of frames kept by the background grabber
+RING_SIZE = 4
+# Maximum time to wait for a new frame before reporting the camera as unreadable
+READ_TIMEOUT = 1.0
+# Number of consecutive failed reads after which the camera is reported as unreadable
+MAX_FAILURES = 10
+
+
+class FrameGrabber(threading.Thread):
+    # Continuously drain a capture device into a small ring buffer of preallocated frames,
+    # so that consumers never block on USB I/O and never receive a stale buffered frame
+
+    def __init__(self, camera, ring_size=RING_SIZE):
+        super().__init__(name=f'FrameGrabber-{camera.camera_id}', daemon=True)
+        self.camera = camera
+        self.ring_size = ring_size
+        self.frames = None
+        self.timestamps = np.zeros(ring_size)
+        self.count = 0          # Total number of frames written to the ring
+        self.failures = 0       # Consecutive failed reads
+        self.new_frame = threading.Condition()
+        self._stop_event = threading.Event()
+
+    def _allocate(self, shape):
+        self.frames = np.empty((self.ring_size, *shape), dtype=np.uint8)
+        logging.debug(f'Allocated a ring of {self.ring_size} frames of shape {shape} for camera {self.camera.camera_id}.')
+
+    def run(self):
+        while not self._stop_event.is_set():
+            slot = self.count % self.ring_size
+            with self.camera._lock:
+                success = self.camera.capture.grab()
+                timestamp = time.monotonic()
+                if success:
+                    # Decode straight into the preallocated slot when its shape is known
+                    target = None if self.frames is None else self.frames[slot]
+                    success, image = self.camera.capture.retrieve(target)
+            if not success:
+                with self.new_frame:
+                    self.failures += 1
+                    self.new_frame.notify_all()
+                time.sleep(0.01)
+                continue
+            # (Re)allocate the ring on the first frame or after a change of resolution
+            if (self.frames is None) or (image.shape != self.frames.shape[1:]):
+                self._allocate(image.shape)
+                self.frames[slot] = image
+            with self.new_frame:
+                self.timestamps[slot] = timestamp
+                self.count += 1
+                self.failures = 0
+                self.new_frame.notify_all()
+
+    def latest(self, after=0, timeout=READ_TIMEOUT, image=None):
+        # Return the freshest frame whose index is greater than `after`, waiting for it if needed
+        deadline = time.monotonic() + timeout
+        with self.new_frame:
+            while self.count <= after:
+                remaining = deadline - time.monotonic()
+                if (remaining <= 0) or (self.failures > MAX_FAILURES):
+                    return False, None, None, after
+                self.new_frame.wait(remaining)
+            index = self.count
+            slot = (index - 1) % self.ring_size
+            timestamp = self.timestamps[slot]
+            source = self.frames[slot]
+        # The copy happens outside of the lock: the grabber would need to wrap around the whole
+        # ring (several frame periods) before overwriting this slot
+        if (image is None) or (image.shape != source.shape):
+            image = source.copy()
+        else:
+            np.copyto(image, source)
+        return True, image, timestamp, index
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=2.0)
+
+
+class Camera:
+
+    def __init__(self, camera_id, resolution=DEFAULT_RESOLUTION, fps=DEFAULT_FPS, autofocus=False, threaded=True):
+        self.camera_id = camera_id
+        self.resolution = None
+        self.fps = None
+        self.autofocus = None
+        self._lock = threading.Lock()
+        self._last_index = 0
+        self.reads = 0          # Frames handed out (frame rate of the consumers, for the benchmarks)
+
+        # Open the device once; it stays warm until release() is called
+        self.capture = hardware.video_capture(camera_id)
+        if USE_MJPEG:
+            self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.configure(resolution, fps, autofocus)
+        logging.debug(f'Opened camera with ID {camera_id}.')
+
+        # Start draining the device in the background
+        self.grabber = None
+        if threaded:
+            self.grabber = FrameGrabber(self)
+            self.grabber.start()
+
+    def configure(self, resolution=None, fps=None, autofocus=None):
+        # Change the settings of the open device, only touching the properties that differ
+        with self._lock:
+            if (resolution is not None) and (tuple(resolution) != self.resolution):
+                self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+                self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+                self.resolution = tuple(resolution)
+            if (fps is not None) and (fps != self.fps):
+                self.capture.set(cv2.CAP_PROP_FPS, fps)
+                self.fps = fps
+            if (autofocus is not None) and (autofocus != self.autofocus):
+                self.capture.set(cv2.CAP_PROP_AUTOFOCUS, int(autofocus))
+                self.autofocus = autofocus
+        logging.debug(f'Configured camera with ID {self.camera_id}: resolution {self.resolution}, fps {self.fps}, autofocus {self.autofocus}.')
+
+    def read_new(self, timeout=READ_TIMEOUT, image=None):
+        # Return the next frame that has not been handed out yet, with its capture timestamp
+        if self.grabber is None:
+            with self._lock:
+                success, image = self.capture.read(image)
+            self.reads += success
+            return success, image, time.monotonic()
+        success, image, timestamp, self._last_index = self.grabber.latest(self._last_index, timeout, image)
+        self.reads += success
+        return success, image, timestamp
+
+    def read_latest(self, image=None):
+        # Return the freshest frame available, even if it has already been handed out
+        if self.grabber is None:
+            return self.read_new(image=image)
+        success, image, timestamp, self._last_index = self.grabber.latest(0, READ_TIMEOUT, image)
+        self.reads += success
+        return success, image, timestamp
+
+    def read(self, image=None):
+        # Same interface as cv2.VideoCapture.read(), but never returns a stale buffered frame
+        success, image, _ = self.read_new(image=image)
+        return success, image
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def release(self):
+        if self.grabber is not None:
+            self.grabber.stop()
+            self.grabber = None
+        with self._lock:
+            self.capture.release()
+        logging.debug(f'Released camera with ID {self.camera_id}.')
+
+
+_cameras = {}
+_cameras_lock = threading.Lock()
+
+
+def get(camera_id, resolution=None, fps=None, autofocus=None):
+    # Return the shared camera for this ID, opening it on first use
+    with _cameras_lock:
+        camera = _cameras.get(camera_id)
+        if camera is None:
+            camera = Camera(camera_id,
+                            resolution=resolution or DEFAULT_RESOLUTION,
+                            fps=fps or DEFAULT_FPS,
+                            autofocus=bool(autofocus))
+            _cameras[camera_id] = camera
+            return camera
+    # Already open: only reconfigure what was asked for
+    camera.configure(resolution, fps, autofocus)
+    return camera
+
+
+def release(camera_id):
+    with _cameras_lock:
+        camera = _cameras.pop(camera_id, None)
+    if camera is not None:
+        camera.release()
+
+
+def release_all():
+    with _cameras_lock:
+        cameras = list(_cameras.values())
+        _cameras.clear()
+    for camera in cameras:
+        camera.release()
@@ -1,15 +1,190 @@
 # Import libraries
+import os
 import time
+import json
+import hashlib
+import logging
 import cv2
 import numpy as np
 
-
-COLOR_MATCH_THRESHOLD = 0.30
-REPEATED_MATCHES = 3
+if __name__ != "__main__":
+    from . import display
+if __name__ == "__main__":
+    import display
 
 
-def start(camera, timer = 1.0, crop_ratio = 1):
+COLOR_MATCH_THRESHOLD = 0.30
 
+# Color detection boundaries (HSV, OpenCV ranges), computed once
+LOWER_RANGE = np.array([int(230/360*180), int(25/100*255), int(25/100*255)], dtype=np.uint8)
+UPPER_RANGE = np.array([int(290/360*180), int(90/100*255), int(80/100*255)], dtype=np.uint8)
+
+# Colour profiles, one per container type/brand: name -> (lower HSV range, upper HSV range)
+COLOUR_PROFILES = {
+    'cauli_purple': (LOWER_RANGE, UPPER_RANGE),
+}
+
+# The crop is subsampled by this factor before matching (1 to use every pixel)
+SUBSAMPLE = 2
+# Classify pixels with a BGR lookup table instead of converting the crop to HSV
+# (both are about as fast for a single profile on a subsampled crop; the table is always used
+# with several profiles, since it classifies a pixel against all of them with one lookup)
+USE_LUT = False
+# Compiled tables are cached in this directory
+LUT_CACHE_DIRECTORY = './data'
+# Exponentially-weighted match score: weight of the newest frame, and minimum number of frames
+SCORE_ALPHA = 0.5
+MIN_FRAMES = 2
+
+
+_luts = {}
+
+def profiles_key(profiles):
+    # Stable identifier of a list of profiles (their order defines their bit in the table)
+    description = json.dumps([[name, [int(v) for v in lower], [int(v) for v in upper]] for name, (lower, upper) in profiles.items()])
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+def compile_lut(profiles):
+    # 256^3 lookup table: bit k of each entry is set if the colour is in the range of profile k
+    # Colours are indexed by (red << 16) | (green << 8) | blue, the value of a BGRA pixel read as a
+    # little-endian uint32 without its alpha byte
+    if len(profiles) > 16:
+        raise ValueError(f'At most 16 colour profiles are supported, got {len(profiles)}')
+    dtype = np.uint8 if len(profiles) <= 8 else np.uint16
+    lut = np.zeros(256 ** 3, dtype=dtype)
+    # One 256x256 (green, blue) plane per red value keeps the memory use low
+    green, blue = np.meshgrid(np.arange(256, dtype=np.uint8), np.arange(256, dtype=np.uint8), indexing='ij')
+    plane = np.empty((256, 256, 3), dtype=np.uint8)
+    plane[..., 0] = blue
+    plane[..., 1] = green
+    for red in range(256):
+        plane[..., 2] = red
+        hsv_plane = cv2.cvtColor(plane, cv2.COLOR_BGR2HSV)
+        values = lut[red << 16:(red + 1) << 16]
+        for bit, (lower_range, upper_range) in enumerate(profiles.values()):
+            values[cv2.inRange(hsv_plane, lower_range, upper_range).reshape(-1) != 0] |= (1 << bit)
+    return lut
+
+def profile_lut(profiles, cache_directory=LUT_CACHE_DIRECTORY):
+    # Compiled lookup table of the profiles, from memory, from the disk cache, or compiled (and cached)
+    key = profiles_key(profiles)
+    if key in _luts:
+        return _luts[key]
+    path = os.path.join(cache_directory, f'colour_lut_{key}.npy')
+    try:
+        lut = np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        logging.info(f'Compiling the colour lookup table for profiles {list(profiles)}...')
+        lut = compile_lut(profiles)
+        try:
+            # Write then rename, so that a partially written table is never loaded
+            temporary_path = path + '.tmp'
+            with open(temporary_path, 'wb') as f:
+                np.save(f, lut)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            logging.warning(f'Could not cache the colour lookup table in {path}: {e}')
+    _luts[key] = lut
+    return lut
+
+
+class ColourMatcher:
+    # Colour-presence engine: fraction of the pixels of a crop that match each colour profile,
+    # smoothed across frames with an exponentially-weighted moving average
+
+    def __init__(self, profiles=None, subsample=SUBSAMPLE, use_lut=USE_LUT, alpha=SCORE_ALPHA):
+        self.profiles = profiles or COLOUR_PROFILES
+        self.names = list(self.profiles)
+        self.subsample = subsample
+        self.lut = profile_lut(self.profiles) if (use_lut or len(self.profiles) > 1) else None
+        self.alpha = alpha
+        if self.lut is not None:
+            # bit_matrix[value, k] is 1 if bit k of the table value is set: turns a histogram of the
+            # table values into the number of pixels matching each profile
+            values = np.arange(256 if self.lut.dtype == np.uint8 else 65536)
+            self.bit_matrix = ((values[:, None] >> np.arange(len(self.names))) & 1).astype(np.float64)
+        self._shape = None
+        self.reset()
+
+    def reset(self):
+        self.scores = np.zeros(len(self.names))
+        self.frames = 0
+
+    def _allocate(self, shape):
+        # Buffers for the subsampled crop, the LUT indices and the mask
+        height, width = shape[0] // self.subsample, shape[1] // self.subsample
+        self.small = np.empty((height, width, 3), dtype=np.uint8)
+        self.hsv = np.empty((height, width, 3), dtype=np.uint8)
+        self.bgra = np.empty((height, width, 4), dtype=np.uint8)
+        self.indices = np.empty((height, width), dtype=np.uint32)
+        self.values = np.empty((height, width), dtype=self.lut.dtype if self.lut is not None else np.uint8)
+        self.mask = np.empty((height, width), dtype=np.uint8)
+        self._shape = shape
+
+    def coverage(self, image):
+        # Fraction of the pixels of `image` (BGR) that match each profile
+        if image.shape != self._shape:
+            self._allocate(image.shape)
+        if self.subsample > 1:
+            image = cv2.resize(image, (self.small.shape[1], self.small.shape[0]), dst=self.small, interpolation=cv2.INTER_NEAREST)
+
+        if self.lut is not None:
+            # Index of each pixel in the table: its BGRA value as a uint32, without the alpha byte
+            cv2.cvtColor(image, cv2.COLOR_BGR2BGRA, dst=self.bgra)
+            np.bitwise_and(self.bgra.view(np.uint32)[..., 0], 0x00FFFFFF, out=self.indices)
+            np.take(self.lut, self.indices, out=self.values)
+            # Pixels matching any profile (only needed for display)
+            if display.enabled():
+                np.not_equal(self.values, 0, out=self.mask.view(bool))
+                self.mask *= 255
+            # Coverage of every profile from a single histogram
+            counts = np.bincount(self.values.reshape(-1), minlength=self.bit_matrix.shape[0])
+            return (counts @ self.bit_matrix) / self.values.size
+
+        # Check which parts of the image are in the color boundaries of each profile
+        cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=self.hsv)
+        coverages = np.empty(len(self.names))
+        for k, (lower_range, upper_range) in enumerate(self.profiles.values()):
+            cv2.inRange(self.hsv, lower_range, upper_range, dst=self.mask)
+            coverages[k] = cv2.countNonZero(self.mask) / self.mask.size
+        return coverages
+
+    def update(self, image):
+        # Add a frame to the match scores, and return the updated scores
+        coverages = self.coverage(image)
+        if self.frames == 0:
+            self.scores[:] = coverages
+        else:
+            self.scores = self.alpha * coverages + (1 - self.alpha) * self.scores
+        self.frames += 1
+        return self.scores
+
+    def matched(self, threshold=COLOR_MATCH_THRESHOLD, min_frames=MIN_FRAMES):
+        # Name of the best matching profile, or None
+        if self.frames < min_frames:
+            return None
+        best = int(np.argmax(self.scores))
+        return self.names[best] if self.scores[best] >= threshold else None
+
+
+_matcher = None
+
+def prepare(profiles=None):
+    # Shared matcher of the profiles, built (with its lookup table) on first use: call it ahead of
+    # the first check, e.g. at start-up
+    global _matcher
+    profiles = profiles or COLOUR_PROFILES
+    if (_matcher is None) or (profiles_key(_matcher.profiles) != profiles_key(profiles)):
+        _matcher = ColourMatcher(profiles)
+    return _matcher
+
+
+def start(camera, timer = 1.0, crop_ratio = 1, stop_event = None, profiles = None):
+
+    # Get the matcher (and its lookup table) before starting the timer: compiling the table
+    # must not eat into the time given to the check
+    matcher = prepare(profiles)
+    matcher.reset()
     end_time = time.time() + timer
 
     # Capture the first video frame
@@ -26,34 +201,30 @@ def start(camera, timer = 1.0, crop_ratio = 1):
     left_border = int((width/2) - (side_length/2))
     right_border = int((width/2) + (side_length/2))
 
-    color_matches = 0
+    color_detected = False
     while(time.time() < end_time):
 
+        # Stop early if another concurrent check asked for it
+        if (stop_event is not None) and stop_event.is_set():
+            break
+
         # Slice the initial image
         center_frame = frame[top_border:bottom_border, left_border:right_border]
-        # cv2.imshow('centerFrame', center_frame)
-
-        # Convert the frame to HSV
-        hsv_center_frame = cv2.cvtColor(center_frame, cv2.COLOR_BGR2HSV)
-        
-        # Define color detection boundaries
-        lower_range = np.array([int(230/360*180), int(25/100*255), int(25/100*255)])
-        upper_range = np.array([int(290/360*180), int(90/100*255), int(80/100*255)])
 
-        # Check which parts of the image are in the color boundaries
-        mask = cv2.inRange(hsv_center_frame, lower_range, upper_range)
-
-        # Check that the Detection Color is present above a certain threshold in the centerFrame
-        if(np.mean(mask) >= COLOR_MATCH_THRESHOLD * 255):
+        # Check that the Detection Color is present above a certain threshold in the centerFrame,
+        # consistently across frames
+        matcher.update(center_frame)
+        profile = matcher.matched()
+        if profile is not None:
             # print("COLOR MATCH")
-            color_matches += 1
-            if(color_matches >= REPEATED_MATCHES):
-                break
+            logging.debug(f'Colour matched profile "{profile}".')
+            color_detected = True
+            break
 
-        cv2.imshow('colorMaskedCenterFrame', mask)
+        display.show('colorMaskedCenterFrame', matcher.mask)
 
         # Capture the next video frame
-        success, frame = camera.read()
+        success, frame = camera.read(frame)
         if not success:
             print("Camera could not be read")
             break
@@ -61,13 +232,13 @@ def start(camera, timer = 1.0, crop_ratio = 1):
         # the 'q' button is set as the
         # quitting button you may use any
         # desired button of your choice
-        if cv2.waitKey(100) & 0xFF == ord('q'):
+        if display.quit_requested():
             break
 
     # Destroy all the windows
-    cv2.destroyAllWindows()
+    display.clear()
 
-    return (color_matches >= 3)
+    return color_detected
 
 
 if __name__ == "__main__":
@@ -0,0 +1,225 @@
+# Import libraries
+import os
+import time
+import struct
+import logging
+import threading
+import cv2
+import numpy as np
+from multiprocessing import shared_memory
+
+
+# Debug sinks: "none" (headless, no drawing at all), "window" (local OpenCV windows),
+# "mjpeg" (one MJPEG stream file per window) or "shm" (shared-memory preview, see scripts/preview.py)
+# Defaults to local windows when a display is available, and to headless otherwise
+DEFAULT_SINK = os.environ.get('CAULI_DISPLAY', 'window' if os.environ.get('DISPLAY') else 'none')
+
+MJPEG_DIRECTORY = './data/preview'
+MJPEG_MAX_FPS = 5
+MJPEG_QUALITY = 70
+# Each stream file is rotated to <name>.1.mjpeg past this size: at most two files per window are kept
+MJPEG_MAX_BYTES = 50 * 1024 * 1024
+
+SHM_PREFIX = 'cauli_preview_'
+SHM_MAX_SHAPE = (1280, 1280, 3)
+SHM_HEADER = struct.Struct('<QIII')     # frame counter, height, width, channels
+
+
+class NoSink:
+    enabled = False
+
+    def show(self, name, image):
+        pass
+
+    def quit_requested(self):
+        return False
+
+    def clear(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class WindowSink:
+    # HighGUI is not thread-safe, and the vision stages may run in several threads
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def show(self, name, image):
+        with self._lock:
+            cv2.imshow(name, image)
+
+    def quit_requested(self):
+        # the 'q' button is set as the quitting button
+        with self._lock:
+            return (cv2.waitKey(1) & 0xFF) == ord('q')
+
+    def clear(self):
+        with self._lock:
+            cv2.destroyAllWindows()
+
+    def close(self):
+        self.clear()
+
+
+class MJPEGSink:
+    # JPEG encoding happens in a background thread, which only ever keeps the latest frame of each window
+    enabled = True
+
+    def __init__(self, directory=MJPEG_DIRECTORY, max_fps=MJPEG_MAX_FPS, quality=MJPEG_QUALITY, max_bytes=MJPEG_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.period = 1 / max_fps
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self._files = {}
+        self._pending = {}
+        self._last_shown = {}
+        self._condition = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._write_loop, name='MJPEGSink', daemon=True)
+        self._thread.start()
+
+    def show(self, name, image):
+        now = time.monotonic()
+        if now - self._last_shown.get(name, 0) < self.period:
+            return
+        self._last_shown[name] = now
+        with self._condition:
+            self._pending[name] = image.copy()
+            self._condition.notify()
+
+    def _write_loop(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                pending, self._pending = self._pending, {}
+            for name, image in pending.items():
+                success, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if not success:
+                    continue
+                if name not in self._files:
+                    self._files[name] = open(self._path(name), 'ab')
+                if self._files[name].tell() + jpeg.nbytes > self.max_bytes:
+                    self._rotate(name)
+                self._files[name].write(jpeg.tobytes())
+                self._files[name].flush()
+
+    def _path(self, name, generation=0):
+        suffix = f'.{generation}' if generation else ''
+        return os.path.join(self.directory, f'{name}{suffix}.mjpeg')
+
+    def _rotate(self, name):
+        # Replace the previous generation, and start the stream again from an empty file
+        self._files[name].close()
+        os.replace(self._path(name), self._path(name, 1))
+        self._files[name] = open(self._path(name), 'wb')
+
+    def quit_requested(self):
+        return False
+
+    def clear(self):
+        pass
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join(timeout=2.0)
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+class SharedMemorySink:
+    # One shared-memory segment per window: a header followed by the pixels of the latest frame
+    enabled = True
+
+    def __init__(self, prefix=SHM_PREFIX, max_shape=SHM_MAX_SHAPE):
+        self.prefix = prefix
+        self.size = SHM_HEADER.size + int(np.prod(max_shape))
+        self._segments = {}
+        self._counters = {}
+
+    def _segment(self, name):
+        segment = self._segments.get(name)
+        if segment is None:
+            segment_name = self.prefix + name.replace(' ', '_')
+            try:
+                segment = shared_memory.SharedMemory(name=segment_name, create=True, size=self.size)
+            except FileExistsError:
+                segment = shared_memory.SharedMemory(name=segment_name)
+            self._segments[name] = segment
+        return segment
+
+    def show(self, name, image):
+        if image.nbytes > self.size - SHM_HEADER.size:
+            return
+        segment = self._segment(name)
+        height, width = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        pixels = np.ndarray(image.shape, dtype=np.uint8, buffer=segment.buf, offset=SHM_HEADER.size)
+        np.copyto(pixels, image, casting='unsafe')
+        # The counter is written last: readers use it to detect new frames
+        counter = self._counters.get(name, 0) + 1
+        self._counters[name] = counter
+        SHM_HEADER.pack_into(segment.buf, 0, counter, height, width, channels)
+
+    def quit_requested(self):
+        return False
+
+    def clear(self):
+        pass
+
+    def close(self):
+        for segment in self._segments.values():
+            segment.close()
+            segment.unlink()
+        self._segments = {}
+
+
+SINKS = {'none': NoSink, 'window': WindowSink, 'mjpeg': MJPEGSink, 'shm': SharedMemorySink}
+
+sink = None
+
+
+def configure(mode=None, **options):
+    # Select the debug sink used by all the vision stages
+    global sink
+    mode = mode or DEFAULT_SINK
+    if mode not in SINKS:
+        raise ValueError(f'Unknown display mode "{mode}", expected one of {list(SINKS)}')
+    if sink is not None:
+        sink.close()
+    sink = SINKS[mode](**options)
+    logging.debug(f'Display configured with the "{mode}" sink.')
+    return sink
+
+def _get_sink():
+    if sink is None:
+        configure()
+    return sink
+
+def enabled():
+    # Whether anything is displayed: drawing work should be skipped altogether when it is not
+    return _get_sink().enabled
+
+def show(name, image):
+    _get_sink().show(name, image)
+
+def quit_requested():
+    return _get_sink().quit_requested()
+
+def clear():
+    # End of a stage: close its windows (the other sinks keep their streams open)
+    _get_sink().clear()
+
+def close():
+    # End of the program
+    _get_sink().close()
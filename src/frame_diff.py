@@ -0,0 +1,92 @@
+# Import libraries
+import cv2
+import numpy as np
+
+
+class FrameDifferencer:
+    # Frame differencing engine shared by motion detection and object tracking:
+    # greyscale -> downscale (optional) -> blur -> absdiff with the previous frame -> dilate -> threshold
+    # All the images are written into buffers allocated once per frame size (OpenCV dst= outputs),
+    # and the current/previous prepared images are swapped instead of being reallocated
+
+    def __init__(self, threshold, dilation, levels=0, blur_size=5, outputs=1):
+        self.threshold = threshold
+        self.kernel = np.ones((dilation, dilation), dtype=np.uint8)
+        self.levels = levels
+        self.blur_size = (blur_size, blur_size)
+        # Number of thresholded images in rotation: increase it when they are consumed by another
+        # thread while the next frame is being processed
+        self.outputs = outputs
+        self._frame_shape = None
+
+    def _allocate(self, frame_shape):
+        height, width = frame_shape[:2]
+        self.gray = np.empty((height, width), dtype=np.uint8)
+        self.pyramid = []
+        for _ in range(self.levels):
+            height, width = (height + 1) // 2, (width + 1) // 2
+            self.pyramid.append(np.empty((height, width), dtype=np.uint8))
+        self.prepared = [np.empty((height, width), dtype=np.uint8) for _ in range(2)]
+        self.diff = np.empty((height, width), dtype=np.uint8)
+        self.dilated = np.empty((height, width), dtype=np.uint8)
+        self.thresholds = [np.empty((height, width), dtype=np.uint8) for _ in range(self.outputs)]
+        self._frame_shape = frame_shape[:2]
+        self.reset()
+
+    def reset(self):
+        # Forget the previous frame
+        self._current = 0
+        self._output = 0
+        self._previous_frame = None
+        self._previous_roi = None
+
+    def prepare(self, frame, roi, index):
+        # Prepare the image (ROI + greyscale + downscale + blur to negate noise) into prepared[index]
+        x, y, width, height = roi
+        gray = self.gray[:height, :width]
+        cv2.cvtColor(frame[y:y+height, x:x+width], cv2.COLOR_BGR2GRAY, dst=gray)
+        source = gray
+        for level in self.pyramid:
+            height, width = (height + 1) // 2, (width + 1) // 2
+            source = cv2.pyrDown(source, dst=level[:height, :width], dstsize=(width, height))
+        return cv2.GaussianBlur(src=source, ksize=self.blur_size, sigmaX=0, dst=self.prepared[index][:height, :width])
+
+    def apply(self, frame, roi=None):
+        # Return the thresholded difference between `frame` and the previous frame, restricted to
+        # `roi` (x, y, width, height) and downscaled; None for the first frame
+        # The previous frame must not be modified if the ROI can change from one call to the next
+        if frame.shape[:2] != self._frame_shape:
+            self._allocate(frame.shape)
+        if roi is None:
+            roi = (0, 0, frame.shape[1], frame.shape[0])
+
+        current = self.prepare(frame, roi, self._current)
+        previous_index = 1 - self._current
+
+        if (self._previous_frame is None):
+            # First frame; there is no previous one yet
+            result = None
+        else:
+            # The previous frame only needs to be prepared again when the ROI changed
+            if roi != self._previous_roi:
+                previous = self.prepare(self._previous_frame, roi, previous_index)
+            else:
+                previous = self.prepared[previous_index][:current.shape[0], :current.shape[1]]
+            height, width = current.shape
+
+            # Calculate difference
+            diff = cv2.absdiff(src1=previous, src2=current, dst=self.diff[:height, :width])
+
+            # Dilate the detected changes to fill in small gaps
+            dilated = cv2.dilate(diff, self.kernel, dst=self.dilated[:height, :width], iterations=1)
+
+            # Find if difference is above a certain threshold
+            result = self.thresholds[self._output][:height, :width]
+            cv2.threshold(src=dilated, thresh=self.threshold, maxval=255, type=cv2.THRESH_BINARY, dst=result)
+            self._output = (self._output + 1) % self.outputs
+
+        # Update previous frame
+        self._current = previous_index
+        self._previous_frame = frame
+        self._previous_roi = roi
+        return result
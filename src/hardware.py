@@ -0,0 +1,327 @@
+# Import libraries
+import os
+import time
+import glob
+import random
+import logging
+import threading
+import cv2
+
+
+# Hardware abstraction: every device (cameras, GPIO, NeoPixels, load cells) is created on first
+# use through this module, so that importing the other modules never touches the hardware
+# In simulation, cameras replay recordings (video files or directories of frames), the load
+# cells follow a scripted weight trace, and the GPIO/LED/servo backends do nothing
+SIMULATION = os.environ.get('CAULI_SIMULATION', '0').lower() not in ('', '0', 'false', 'no')
+
+# Replay speed of the recordings: 1.0 is real time, 0 is as fast as they can be decoded
+REPLAY_SPEED = 1.0
+# Scale of the fixed pauses (LED animations, iris motor, error pauses) in simulation: 0 skips them
+SIMULATION_SLEEP_SCALE = 0.0
+# Noise of the simulated load cells (grams, standard deviation)
+LOAD_CELL_NOISE = 0.2
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+# Frame rate of the recordings stored as directories of frames (video files carry their own)
+DIRECTORY_FPS = 30.0
+
+_config = {
+    'simulation': SIMULATION,
+    'recordings': {},       # camera ID -> video file or frame directory
+    'speed': REPLAY_SPEED,
+    'loop': True,
+    'sleep_scale': SIMULATION_SLEEP_SCALE,
+    'fps': None,            # overrides the frame rate of the recordings
+}
+_lock = threading.RLock()
+_devices = {}
+
+
+def configure(simulation=None, recordings=None, speed=None, loop=None, sleep_scale=None, load_cell_trace=None, fps=None):
+    # Select the hardware backends; must be called before the devices are first used
+    with _lock:
+        if simulation is not None:
+            _config['simulation'] = simulation
+        if recordings is not None:
+            _config['recordings'] = dict(recordings)
+        if speed is not None:
+            _config['speed'] = speed
+        if loop is not None:
+            _config['loop'] = loop
+        if sleep_scale is not None:
+            _config['sleep_scale'] = sleep_scale
+        if load_cell_trace is not None:
+            _devices['load_cell_trace'] = load_cell_trace
+        if fps is not None:
+            _config['fps'] = fps
+
+def simulated():
+    return _config['simulation']
+
+def sleep(seconds):
+    # Fixed pauses of the collection cycle (scaled down in simulation)
+    if _config['simulation']:
+        seconds *= _config['sleep_scale']
+    if seconds > 0:
+        time.sleep(seconds)
+
+def _device(name, factory):
+    with _lock:
+        device = _devices.get(name)
+        if device is None:
+            device = _devices[name] = factory()
+        return device
+
+
+# --- GPIO (iris servo) ---
+
+class FakePWM:
+
+    def __init__(self, gpio, pin, frequency):
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self.duty = None
+
+    def start(self, duty):
+        self.ChangeDutyCycle(duty)
+
+    def ChangeDutyCycle(self, duty):
+        self.duty = duty
+        self.gpio.history.append((time.monotonic(), self.pin, duty))
+
+    def stop(self):
+        self.duty = None
+
+
+class FakeGPIO:
+    # Same interface as RPi.GPIO; records the duty cycles applied to each pin
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+
+    def __init__(self):
+        self.mode = None
+        self.pins = {}
+        self.history = []
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction):
+        self.pins[pin] = direction
+
+    def PWM(self, pin, frequency):
+        return FakePWM(self, pin, frequency)
+
+    def cleanup(self):
+        self.pins = {}
+
+
+def gpio():
+    def factory():
+        if _config['simulation']:
+            return FakeGPIO()
+        import RPi.GPIO
+        return RPi.GPIO
+    return _device('gpio', factory)
+
+
+# --- NeoPixels (LEDs) ---
+
+class FakePixels:
+    # Same interface as neopixel.NeoPixel, for fill(); remembers the last colour
+
+    def __init__(self, count):
+        self.count = count
+        self.colour = (0, 0, 0)
+
+    def fill(self, colour):
+        self.colour = tuple(int(c) for c in colour)
+
+    def __len__(self):
+        return self.count
+
+
+def pixels(count, brightness):
+    def factory():
+        if _config['simulation']:
+            return FakePixels(count)
+        import board
+        import neopixel
+        return neopixel.NeoPixel(board.D18, count, bpp=3, brightness=brightness)
+    return _device('pixels', factory)
+
+
+# --- Load cells ---
+
+class LoadCellTrace:
+    # Scripted weight on the platform: a list of (time, grams) steps, relative to start()
+    # The weight can also be set directly (set_weight) by a simulation driving the cycle
+
+    def __init__(self, steps=((0.0, 0.0),), noise=LOAD_CELL_NOISE, loop_period=None):
+        self.steps = sorted(steps)
+        self.noise = noise
+        self.loop_period = loop_period
+        self.start()
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self.override = None
+
+    def set_weight(self, grams):
+        self.override = grams
+
+    def weight(self):
+        if self.override is not None:
+            weight = self.override
+        else:
+            elapsed = time.monotonic() - self.start_time
+            if self.loop_period:
+                elapsed %= self.loop_period
+            weight = self.steps[0][1]
+            for step_time, step_weight in self.steps:
+                if step_time > elapsed:
+                    break
+                weight = step_weight
+        return weight + random.gauss(0, self.noise)
+
+
+class FakeLoadCell:
+    # Same interface as DFRobot_HX711_I2C; carries `share` of the weight of the trace
+    # (the real cells are mounted upside down: they read negative weights)
+
+    def __init__(self, trace, share):
+        self.trace = trace
+        self.share = share
+        self.offset = 0.0
+
+    def begin(self):
+        pass
+
+    def set_calibration(self, value):
+        pass
+
+    def peel(self):
+        self.offset = self.trace.weight() * self.share
+
+    def read_weight(self, times):
+        return - (self.trace.weight() * self.share - self.offset)
+
+
+def load_cell_trace():
+    return _device('load_cell_trace', LoadCellTrace)
+
+def load_cells(mode, addresses, calibrations):
+    def factory():
+        if _config['simulation']:
+            trace = load_cell_trace()
+            cells = [FakeLoadCell(trace, 1 / len(addresses)) for _ in addresses]
+        else:
+            from .lib.DFRobot_HX711_I2C import DFRobot_HX711_I2C
+            cells = [DFRobot_HX711_I2C(mode, address) for address in addresses]
+        for cell, calibration in zip(cells, calibrations):
+            cell.begin()
+            cell.set_calibration(calibration)
+        return cells
+    return _device('load_cells', factory)
+
+
+# --- Cameras ---
+
+class ReplayCapture:
+    # Same interface as cv2.VideoCapture, reading a recording (video file or directory of frames)
+    # Frames are paced at `speed` times the recording frame rate (0: as fast as possible), and the
+    # recording starts over at the end when `loop` is set
+
+    def __init__(self, source, speed=REPLAY_SPEED, loop=True, fps=None):
+        self.source = source
+        self.speed = speed
+        self.loop = loop
+        self.size = None
+        self._frame = None
+        self._next_time = None
+        if os.path.isdir(source):
+            self.files = sorted(f for f in glob.glob(os.path.join(source, '*')) if f.lower().endswith(IMAGE_EXTENSIONS))
+            self.video = None
+            self.fps = fps or DIRECTORY_FPS
+            self._position = 0
+        else:
+            self.files = None
+            self.video = cv2.VideoCapture(source)
+            self.fps = fps or self.video.get(cv2.CAP_PROP_FPS) or 30.0
+        logging.debug(f'Replaying {source} at {self.fps} fps x{speed}.')
+
+    def isOpened(self):
+        return bool(self.files) if self.video is None else self.video.isOpened()
+
+    def _read_source(self):
+        if self.video is None:
+            if self._position >= len(self.files):
+                if not self.loop:
+                    return None
+                self._position = 0
+            frame = cv2.imread(self.files[self._position])
+            self._position += 1
+            return frame
+        success, frame = self.video.read()
+        if not success and self.loop:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = self.video.read()
+        return frame if success else None
+
+    def grab(self):
+        # Wait for the frame time, like a real camera would
+        if self.speed > 0:
+            now = time.monotonic()
+            if self._next_time is None:
+                self._next_time = now
+            elif self._next_time > now:
+                time.sleep(self._next_time - now)
+            self._next_time = max(self._next_time, now - 1 / self.fps) + 1 / (self.fps * self.speed)
+        self._frame = self._read_source()
+        return self._frame is not None
+
+    def retrieve(self, image=None):
+        frame = self._frame
+        if frame is None:
+            return False, None
+        if (self.size is not None) and (frame.shape[1::-1] != self.size):
+            frame = cv2.resize(frame, self.size)
+        if (image is not None) and (image.shape == frame.shape):
+            image[...] = frame
+            return True, image
+        return True, frame
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def set(self, prop, value):
+        # Resolution requests resize the frames; the other properties are accepted and ignored
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            self.size = (int(value), self.size[1] if self.size else int(value * 3 / 4))
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            self.size = (self.size[0] if self.size else int(value * 4 / 3), int(value))
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0.0
+
+    def release(self):
+        if self.video is not None:
+            self.video.release()
+
+
+def video_capture(camera_id):
+    # Open a camera, or its recording in simulation
+    if not _config['simulation']:
+        return cv2.VideoCapture(camera_id)
+    source = _config['recordings'].get(camera_id, camera_id if isinstance(camera_id, str) else None)
+    if source is None:
+        raise ValueError(f'No recording configured for camera {camera_id} in simulation')
+    return ReplayCapture(source, speed=_config['speed'], loop=_config['loop'], fps=_config['fps'])
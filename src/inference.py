@@ -0,0 +1,197 @@
+# Import libraries
+import time
+import logging
+import threading
+import collections
+import multiprocessing as mp
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+NUM_THREADS = 4
+WARMUP_RUNS = 2
+LATENCY_HISTORY = 100
+STARTUP_TIMEOUT = 60.0
+
+
+def _output_quantization(signature_fn):
+    # (scale, zero point) of the quantized outputs of a signature, by output name
+    try:
+        output_details = signature_fn.get_output_details()
+    except AttributeError:
+        # Older runtimes: outputs are returned as they are
+        return {}
+    quantization = {}
+    for name, details in output_details.items():
+        scale, zero_point = details.get('quantization', (0.0, 0))
+        if scale and np.issubdtype(np.dtype(details['dtype']), np.integer):
+            quantization[name] = (float(scale), int(zero_point))
+    return quantization
+
+def dequantize(output, quantization):
+    # Real values of the quantized outputs of a model (the others are left as they are)
+    for name, (scale, zero_point) in quantization.items():
+        if name in output:
+            output[name] = scale * (output[name].astype(np.float32) - zero_point)
+    return output
+
+
+def _worker(model_path, num_threads, warmup_runs, connection):
+    # Long-lived process that owns the TFLite interpreter
+    try:
+        try:
+            import tflite_runtime.interpreter as tflite
+        except ImportError:
+            # Full TensorFlow, e.g. when running the simulation on a laptop
+            from tensorflow import lite as tflite
+        interpreter = tflite.Interpreter(model_path=model_path, num_threads=num_threads)
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()
+        output_details = interpreter.get_output_details()
+
+        # Cache the signature runner and the name of its input once and for all
+        signatures = interpreter.get_signature_list()
+        signature_key = next(iter(signatures))
+        input_name = signatures[signature_key]['inputs'][0]
+        signature_fn = interpreter.get_signature_runner(signature_key)
+        # Full-integer models may have quantized outputs: they are dequantized here, so that the
+        # detections always come out as real values
+        output_quantization = _output_quantization(signature_fn)
+    except Exception as e:
+        connection.send(('error', repr(e)))
+        return
+
+    # Frames are passed through shared memory, only small messages go through the pipe
+    shape = tuple(input_details[0]['shape'])
+    dtype = np.dtype(input_details[0]['dtype'])
+    shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * dtype.itemsize)
+    input_buffer = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    # Warm-up: the first inferences are always the slowest
+    input_buffer.fill(0)
+    warmup_latencies = []
+    for _ in range(warmup_runs):
+        start = time.perf_counter()
+        signature_fn(**{input_name: input_buffer})
+        warmup_latencies.append(time.perf_counter() - start)
+
+    connection.send(('ready', {
+        'shm_name': shm.name,
+        'input_details': input_details,
+        'output_details': output_details,
+        'output_quantization': output_quantization,
+        'warmup_latencies': warmup_latencies,
+    }))
+
+    try:
+        while True:
+            command = connection.recv()
+            if command == 'stop':
+                break
+            try:
+                start = time.perf_counter()
+                output = signature_fn(**{input_name: input_buffer})
+                latency = time.perf_counter() - start
+                dequantize(output, output_quantization)
+                connection.send(('ok', output, latency))
+            except Exception as e:
+                connection.send(('error', repr(e), 0.0))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        del input_buffer
+        shm.close()
+        shm.unlink()
+
+
+class InferenceService:
+
+    def __init__(self, model_path, num_threads=NUM_THREADS, warmup_runs=WARMUP_RUNS):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.latencies = collections.deque(maxlen=LATENCY_HISTORY)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inference')
+
+        # The worker is forked: start the service before any other thread (e.g. camera grabbers)
+        # It shares the resource tracker of this process, which must be running before the fork
+        resource_tracker.ensure_running()
+        context = mp.get_context('fork')
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_worker, name='InferenceService',
+                                        args=(model_path, num_threads, warmup_runs, child_connection),
+                                        daemon=True)
+        self._process.start()
+        child_connection.close()
+
+        if not self._connection.poll(STARTUP_TIMEOUT):
+            self._process.terminate()
+            raise RuntimeError(f'Inference worker did not start within {STARTUP_TIMEOUT}s')
+        status, info = self._connection.recv()
+        if status != 'ready':
+            self._process.join()
+            raise RuntimeError(f'Inference worker could not load {model_path}: {info}')
+        self.input_details = info['input_details']
+        self.output_details = info['output_details']
+        self.input_shape = self.input_details[0]['shape']
+        self.input_dtype = self.input_details[0]['dtype']
+        self.output_quantization = info['output_quantization']
+
+        # The input buffer lives in shared memory: writing into it is all it takes to send a frame
+        # The worker owns (and unlinks) the segment; attaching registers it again with the shared
+        # tracker, which is a no-op, and the worker's unlink unregisters it once and for all
+        self._shm = shared_memory.SharedMemory(name=info['shm_name'])
+        self.input_buffer = np.ndarray(tuple(self.input_shape), dtype=self.input_dtype, buffer=self._shm.buf)
+
+        warmup = ', '.join(f'{latency:.3f}s' for latency in info['warmup_latencies'])
+        logging.info(f'Inference service started for {model_path} ({np.dtype(self.input_dtype).name} input) '
+                     f'with {num_threads} threads (warm-up: {warmup}).')
+
+    def infer(self, data=None):
+        # Run the model on `data`, or on the current content of the input buffer if None
+        # Returns the model outputs and the inference latency (in seconds)
+        with self._lock:
+            if data is not None:
+                np.copyto(self.input_buffer, data, casting='unsafe')
+            try:
+                self._connection.send('infer')
+                status, output, latency = self._connection.recv()
+            except (EOFError, BrokenPipeError, OSError):
+                raise RuntimeError('Inference worker is not running')
+        if status != 'ok':
+            raise RuntimeError(f'Inference failed: {output}')
+        self.latencies.append(latency)
+        return output, latency
+
+    def infer_async(self, data=None):
+        # Same as infer(), but returns a concurrent.futures.Future
+        # `data` (or the input buffer) must not be modified until the future is done
+        return self._executor.submit(self.infer, data)
+
+    def stats(self):
+        if len(self.latencies) == 0:
+            return {'count': 0}
+        latencies = np.array(self.latencies)
+        return {
+            'count': len(latencies),
+            'mean': float(latencies.mean()),
+            'min': float(latencies.min()),
+            'max': float(latencies.max()),
+            'last': float(latencies[-1]),
+        }
+
+    def stop(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            try:
+                self._connection.send('stop')
+            except (BrokenPipeError, OSError):
+                pass
+            self._process.join(timeout=5.0)
+            if self._process.is_alive():
+                self._process.terminate()
+            del self.input_buffer
+            self._shm.close()
+            self._connection.close()
+        logging.info(f'Inference service stopped.')
@@ -1,16 +1,35 @@
-import RPi.GPIO as GPIO
 import time
+import threading
 
+# Also imported as a top-level module by the other modules' __main__ blocks
+if __package__:
+    from . import metrics
+    from . import hardware
+else:
+    import metrics
+    import hardware
 
+
+IRIS_PIN = 12
 DUTY_BRACKET = (950, 1700)
 OPEN_DURATION = 1.0
 CLOSE_DURATION = 1.0
+# Scheduled actions sleep until this long before their deadline, then spin for precision
+SPIN_MARGIN = 0.002
+
 
+# The GPIO pin is set up on first use (see hardware.py)
+_gpio = None
+_gpio_lock = threading.Lock()
 
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(12, GPIO.OUT)
-# pwm = GPIO.PWM(12, 50)
-# pwm.start(0)
+def _get_gpio():
+    global _gpio
+    with _gpio_lock:
+        if _gpio is None:
+            _gpio = hardware.gpio()
+            _gpio.setmode(_gpio.BCM)
+            _gpio.setup(IRIS_PIN, _gpio.OUT)
+        return _gpio
 
 
 def duty_from_dir(dir):
@@ -28,10 +47,10 @@ def duty_from_dir(dir):
 def open():
     # GPIO.setmode(GPIO.BCM)
     # GPIO.setup(12, GPIO.OUT)
-    pwm = GPIO.PWM(12, 50)
+    pwm = _get_gpio().PWM(IRIS_PIN, 50)
     pwm.start(0)
     pwm.ChangeDutyCycle(duty_from_dir(0.5))
-    time.sleep(OPEN_DURATION)
+    hardware.sleep(OPEN_DURATION)
     pwm.ChangeDutyCycle(duty_from_dir(0))
     pwm.stop()
     
@@ -39,17 +58,17 @@ def open():
 def close():
     # GPIO.setmode(GPIO.BCM)
     # GPIO.setup(12, GPIO.OUT)
-    pwm = GPIO.PWM(12, 50)
+    pwm = _get_gpio().PWM(IRIS_PIN, 50)
     pwm.start(0)
     pwm.ChangeDutyCycle(duty_from_dir(-0.5))
-    time.sleep(CLOSE_DURATION)
+    hardware.sleep(CLOSE_DURATION)
     pwm.ChangeDutyCycle(duty_from_dir(0))
     pwm.stop()
 
 def open_continuously():
     # GPIO.setmode(GPIO.BCM)
     # GPIO.setup(12, GPIO.OUT)
-    pwm = GPIO.PWM(12, 50)
+    pwm = _get_gpio().PWM(IRIS_PIN, 50)
     pwm.start(0)
     pwm.ChangeDutyCycle(duty_from_dir(0.5))
     return pwm
@@ -59,7 +78,47 @@ def stop(pwm):
     pwm.stop()
 
 def cleanup():
-    GPIO.cleanup()
+    if _gpio is not None:
+        _gpio.cleanup()
+
+
+class ScheduledOpening(threading.Thread):
+    # Open the iris at `open_time` and stop it `duration` seconds later (time.monotonic() clock),
+    # in its own thread so that the timing does not depend on the image processing
+
+    def __init__(self, open_time, duration=OPEN_DURATION):
+        super().__init__(name='IrisControl', daemon=True)
+        self.open_time = open_time
+        self.duration = duration
+        self.opened_at = None
+        self.stopped_at = None
+        self._cancelled = threading.Event()
+
+    def _sleep_until(self, deadline):
+        # Coarse wait (interruptible by cancel()), then spin until the deadline
+        remaining = deadline - time.monotonic() - SPIN_MARGIN
+        if (remaining > 0) and self._cancelled.wait(remaining):
+            return False
+        while time.monotonic() < deadline:
+            pass
+        return not self._cancelled.is_set()
+
+    def run(self):
+        if not self._sleep_until(self.open_time):
+            return
+        pwm = open_continuously()
+        self.opened_at = time.monotonic()
+        # Stop the motor on time, or straight away if cancelled
+        self._sleep_until(self.opened_at + self.duration)
+        stop(pwm)
+        self.stopped_at = time.monotonic()
+        # How late the opening started, and how long the motor actually ran
+        metrics.observe('iris_open_lateness', self.opened_at - self.open_time)
+        metrics.observe('iris_open', self.stopped_at - self.opened_at, self.opened_at)
+
+    def cancel(self):
+        self._cancelled.set()
+        self.join()
 
 
 if __name__ == "__main__":
@@ -75,4 +134,4 @@ if __name__ == "__main__":
     time.sleep(1.5)
     close()
 
-    GPIO.cleanup()
+    cleanup()
@@ -0,0 +1,418 @@
+# Import libraries
+import os
+import csv
+import zlib
+import struct
+import logging
+import threading
+import collections
+
+
+JOURNAL_PATH = './data/collections.journal'
+# Default CSV exports: next to, not over, the legacy files the journal was imported from
+EXPORT_RECORDS_PATH = './data/collections_export.csv'
+EXPORT_BACKLOG_PATH = './data/backlog_export.csv'
+
+# Group commit: appended records are fsynced together, at most COMMIT_INTERVAL seconds after
+# being written, or as soon as COMMIT_BATCH records are waiting (fewer writes to the SD card)
+COMMIT_INTERVAL = 1.0
+COMMIT_BATCH = 32
+# Compact the journal once this many bytes of acknowledged confirmations can be reclaimed
+COMPACTION_THRESHOLD = 1 << 20
+
+# Record kinds
+COLLECTION = 1      # collection record: timestamp, type, id, status
+CONFIRMATION = 2    # collection confirmation to send to the backend: timestamp, type, id
+
+# Framing: magic, payload length, CRC32 of sequence number + payload, sequence number
+RECORD_MAGIC = 0xCA11
+RECORD_HEADER = struct.Struct('<HIIQ')
+PAYLOAD_HEADER = struct.Struct('<Bd')   # kind, timestamp
+FIELD_LENGTH = struct.Struct('<H')
+SEQUENCE = struct.Struct('<Q')
+MAGIC_BYTES = struct.pack('<H', RECORD_MAGIC)
+# Quarantined spans: offset in the journal, length, then the bytes
+QUARANTINE_HEADER = struct.Struct('<QI')
+
+# Header rows of the original CSV files
+RECORDS_CSV_HEADER = ['timestamp', 'container_type', 'container_id', 'status']
+BACKLOG_CSV_HEADER = ['timestamp', 'container_type', 'container_id']
+
+Record = collections.namedtuple('Record', ['seq', 'kind', 'timestamp', 'type', 'id', 'status'])
+
+
+def encode_record(record):
+    payload = [PAYLOAD_HEADER.pack(record.kind, record.timestamp)]
+    for field in (record.type, record.id, record.status or ''):
+        data = str(field).encode('utf-8')
+        payload.append(FIELD_LENGTH.pack(len(data)))
+        payload.append(data)
+    payload = b''.join(payload)
+    crc = zlib.crc32(payload, zlib.crc32(SEQUENCE.pack(record.seq)))
+    return RECORD_HEADER.pack(RECORD_MAGIC, len(payload), crc, record.seq) + payload
+
+def decode_payload(seq, payload):
+    kind, timestamp = PAYLOAD_HEADER.unpack_from(payload, 0)
+    offset = PAYLOAD_HEADER.size
+    fields = []
+    for _ in range(3):
+        (length,) = FIELD_LENGTH.unpack_from(payload, offset)
+        offset += FIELD_LENGTH.size
+        fields.append(payload[offset:offset + length].decode('utf-8'))
+        offset += length
+    return Record(seq, kind, timestamp, fields[0], fields[1], fields[2] or None)
+
+def _record_at(data, offset):
+    # Decode the record at `offset` of `data`: (size, record), or None if it is torn or corrupted
+    if offset + RECORD_HEADER.size > len(data):
+        return None
+    magic, length, crc, seq = RECORD_HEADER.unpack_from(data, offset)
+    if magic != RECORD_MAGIC:
+        return None
+    start = offset + RECORD_HEADER.size
+    payload = data[start:start + length]
+    if (len(payload) < length) or (zlib.crc32(payload, zlib.crc32(SEQUENCE.pack(seq))) != crc):
+        return None
+    try:
+        record = decode_payload(seq, payload)
+    except (struct.error, UnicodeDecodeError):
+        return None
+    return RECORD_HEADER.size + length, record
+
+def scan_records(f):
+    # Yield (offset, size, record) for every valid record of an open journal file, and
+    # (offset, size, None) for every damaged span: after a corrupted record (e.g. a worn SD card
+    # sector) the scan resynchronises on the next magic number that starts a valid record
+    # A damaged span that runs to the end of the file is a torn tail (an interrupted write)
+    # The journal is read at once: it only holds collections and unsent confirmations
+    base = f.tell()
+    data = f.read()
+    offset = 0
+    while offset < len(data):
+        decoded = _record_at(data, offset)
+        if decoded is not None:
+            size, record = decoded
+            yield base + offset, size, record
+            offset += size
+            continue
+        resync = data.find(MAGIC_BYTES, offset + 1)
+        while (resync != -1) and (_record_at(data, resync) is None):
+            resync = data.find(MAGIC_BYTES, resync + 1)
+        end = len(data) if resync == -1 else resync
+        yield base + offset, end - offset, None
+        offset = end
+
+def read_records(f):
+    # Yield (offset, size, record) for every valid record of an open journal file, skipping the
+    # damaged spans (see scan_records)
+    for offset, size, record in scan_records(f):
+        if record is not None:
+            yield offset, size, record
+
+def _fsync_directory(path):
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class Journal:
+    # Single long-lived append-only log of framed records (collections and confirmations)
+    # Unsent confirmations are kept in memory, in order, to be dequeued cheaply; on disk, the "sent"
+    # cursor stored next to the journal is the seq before the oldest unsent confirmation (after a
+    # crash, confirmations acknowledged out of order past it are sent again)
+
+    def __init__(self, path=JOURNAL_PATH, commit_interval=COMMIT_INTERVAL, commit_batch=COMMIT_BATCH,
+                 compaction_threshold=COMPACTION_THRESHOLD):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.cursor_path = path + '.cursor'
+        self.commit_interval = commit_interval
+        self.commit_batch = commit_batch
+        self.compaction_threshold = compaction_threshold
+        self._lock = threading.Lock()
+        self._commit_condition = threading.Condition(self._lock)
+        self._written = 0       # seq of the last record written
+        self._committed = 0     # seq of the last record fsynced
+        self.cursor = self._read_cursor()
+        self.unsent = {}    # seq -> record, oldest first
+        self.reclaimable = 0
+        self._recover()
+        self._file = open(self.path, 'ab')
+        self._running = True
+        self._thread = threading.Thread(target=self._commit_loop, name='JournalCommit', daemon=True)
+        self._thread.start()
+
+    def _read_cursor(self):
+        try:
+            with open(self.cursor_path, 'rb') as f:
+                return SEQUENCE.unpack(f.read(SEQUENCE.size))[0]
+        except (FileNotFoundError, struct.error):
+            return 0
+
+    def _write_cursor(self, seq):
+        # Atomic update: write a new file, then rename it over the old one
+        temporary_path = self.cursor_path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(SEQUENCE.pack(seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.cursor_path)
+
+    def _recover(self):
+        # Scan the journal, rebuild the unsent queue, truncate a torn tail and move the damaged
+        # spans found in the middle of the journal to the quarantine file
+        if not os.path.exists(self.path):
+            return
+        records = []
+        damaged = []
+        with open(self.path, 'rb') as f:
+            for offset, size, record in scan_records(f):
+                if record is None:
+                    damaged.append((offset, size))
+                    continue
+                records.append(record)
+                self._written = record.seq
+                if record.kind == CONFIRMATION:
+                    if record.seq > self.cursor:
+                        self.unsent[record.seq] = record
+                    else:
+                        self.reclaimable += size
+        # Compaction may have dropped the last records: never reuse a seq at or before the cursor
+        self._written = max(self._written, self.cursor)
+        self._committed = self._written
+
+        size = os.path.getsize(self.path)
+        tail = damaged.pop() if damaged and (sum(damaged[-1]) == size) else None
+        if damaged:
+            self._quarantine(damaged)
+            self._rewrite(records)
+        elif tail is not None:
+            with open(self.path, 'r+b') as f:
+                f.truncate(tail[0])
+                os.fsync(f.fileno())
+        if tail is not None:
+            logging.warning(f'Journal {self.path}: discarding {tail[1]} bytes of torn records.')
+
+    def _quarantine(self, spans):
+        # Append the damaged spans of the journal to the quarantine file, for inspection
+        quarantine_path = self.path + '.quarantine'
+        with open(self.path, 'rb') as source, open(quarantine_path, 'ab') as destination:
+            for offset, size in spans:
+                source.seek(offset)
+                destination.write(QUARANTINE_HEADER.pack(offset, size) + source.read(size))
+            destination.flush()
+            os.fsync(destination.fileno())
+        logging.warning(f'Journal {self.path}: moved {len(spans)} damaged spans '
+                        f'({sum(size for _, size in spans)} bytes) to {quarantine_path}.')
+
+    def _rewrite(self, records):
+        # Replace the journal with `records` (before it is opened for appending)
+        temporary_path = self.path + '.rewrite'
+        with open(temporary_path, 'wb') as f:
+            for record in records:
+                f.write(encode_record(record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
+        _fsync_directory(self.path)
+
+    def _append(self, kind, timestamp, c_type, c_id, status=None):
+        with self._lock:
+            record = Record(self._written + 1, kind, timestamp, c_type, c_id, status)
+            self._file.write(encode_record(record))
+            self._written = record.seq
+            if kind == CONFIRMATION:
+                self.unsent[record.seq] = record
+            if self._written - self._committed >= self.commit_batch:
+                self._commit_condition.notify_all()
+        return record
+
+    def wait_committed(self, seq):
+        # Block until the record `seq` is on disk
+        while True:
+            with self._lock:
+                if self._committed >= seq:
+                    return
+            self.commit()
+
+    def append_collection(self, timestamp, c_type, c_id, status, sync=False):
+        record = self._append(COLLECTION, timestamp, c_type, c_id, status)
+        if sync:
+            self.wait_committed(record.seq)
+        return record
+
+    def append_confirmation(self, timestamp, c_type, c_id, sync=False):
+        record = self._append(CONFIRMATION, timestamp, c_type, c_id)
+        if sync:
+            self.wait_committed(record.seq)
+        return record
+
+    def commit(self):
+        # Flush and fsync everything appended so far
+        # The fsync happens outside the lock, so that appends never wait for the SD card
+        with self._lock:
+            if self._committed == self._written:
+                return
+            written = self._written
+            self._file.flush()
+            fd = os.dup(self._file.fileno())
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        with self._lock:
+            self._committed = max(self._committed, written)
+            self._commit_condition.notify_all()
+
+    def _commit_loop(self):
+        while True:
+            with self._lock:
+                if not self._running:
+                    return
+                self._commit_condition.wait(self.commit_interval)
+            self.commit()
+
+    def pending(self, limit=None, exclude=()):
+        # Unsent confirmations, oldest first (except the seqs in `exclude`)
+        with self._lock:
+            records = (record for seq, record in self.unsent.items() if seq not in exclude)
+            if limit is None:
+                return list(records)
+            return [record for _, record in zip(range(limit), records)]
+
+    def acknowledge(self, seqs):
+        # Mark confirmations as sent
+        with self._lock:
+            acknowledged = 0
+            for seq in seqs:
+                record = self.unsent.pop(seq, None)
+                if record is not None:
+                    self.reclaimable += len(encode_record(record))
+                    acknowledged += 1
+            cursor = (next(iter(self.unsent)) - 1) if self.unsent else self._written
+            if cursor > self.cursor:
+                self.cursor = cursor
+                self._write_cursor(cursor)
+            compact = self.reclaimable >= self.compaction_threshold
+        if compact:
+            self.compact()
+        return acknowledged
+
+    def records(self, kind=None):
+        # Every committed or written record of the journal, in order
+        with self._lock:
+            self._file.flush()
+            with open(self.path, 'rb') as f:
+                return [record for _, _, record in read_records(f) if (kind is None) or (record.kind == kind)]
+
+    def compact(self):
+        # Rewrite the journal without the confirmations that were sent
+        with self._lock:
+            self._file.flush()
+            temporary_path = self.path + '.compact'
+            kept = 0
+            with open(self.path, 'rb') as source, open(temporary_path, 'wb') as destination:
+                for offset, size, record in read_records(source):
+                    if (record.kind == CONFIRMATION) and (record.seq not in self.unsent):
+                        continue
+                    destination.write(encode_record(record))
+                    kept += 1
+                destination.flush()
+                os.fsync(destination.fileno())
+            self._file.close()
+            os.replace(temporary_path, self.path)
+            _fsync_directory(self.path)
+            self._file = open(self.path, 'ab')
+            self._committed = self._written
+            self._commit_condition.notify_all()
+            reclaimed, self.reclaimable = self.reclaimable, 0
+        logging.debug(f'Journal compacted: {kept} records kept, {reclaimed} bytes reclaimed.')
+        return reclaimed
+
+    def export_csv(self, records_path=None, backlog_path=None):
+        # Export to the original CSV files: collections (timestamp, type, id, status) and
+        # unsent confirmations (timestamp, type, id)
+        if records_path is not None:
+            with open(records_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(RECORDS_CSV_HEADER)
+                for r in self.records(COLLECTION):
+                    writer.writerow([r.timestamp, r.type, r.id, r.status])
+        if backlog_path is not None:
+            with open(backlog_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(BACKLOG_CSV_HEADER)
+                for r in self.pending():
+                    writer.writerow([r.timestamp, r.type, r.id])
+
+    def import_csv(self, records_path=None, backlog_path=None):
+        # Import the original CSV files (header rows, and rows of the wrong length or without a
+        # numeric timestamp, are skipped)
+        imported = 0
+        for path, kind, length in ((records_path, COLLECTION, 4), (backlog_path, CONFIRMATION, 3)):
+            if path is None or not os.path.exists(path):
+                continue
+            with open(path, newline='') as f:
+                for row in csv.reader(f):
+                    if len(row) != length:
+                        continue
+                    try:
+                        timestamp = float(row[0])
+                    except ValueError:
+                        continue
+                    self._append(kind, timestamp, *row[1:])
+                    imported += 1
+        self.commit()
+        return imported
+
+    def close(self):
+        with self._lock:
+            self._running = False
+            self._commit_condition.notify_all()
+        self._thread.join()
+        self.commit()
+        self._file.close()
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get(path=JOURNAL_PATH, legacy_records_path=None, legacy_backlog_path=None):
+    # Return the shared journal, opening it on first use
+    # A new journal starts with the content of the legacy CSV files, if any
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            if not os.path.exists(path):
+                _import_legacy(path, legacy_records_path, legacy_backlog_path)
+            _journal = Journal(path)
+        return _journal
+
+
+def _import_legacy(path, records_path, backlog_path):
+    # Build the new journal from the legacy CSV files next to it, then rename it into place: an
+    # interrupted or failed import leaves no journal behind, and is started again on the next run
+    temporary_path = path + '.import'
+    for leftover in (temporary_path, temporary_path + '.cursor'):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    imported_journal = Journal(temporary_path)
+    try:
+        imported = imported_journal.import_csv(records_path, backlog_path)
+    finally:
+        imported_journal.close()
+    os.replace(temporary_path, path)
+    _fsync_directory(path)
+    if imported:
+        logging.info(f'Imported {imported} rows from the CSV files into the journal.')
+
+
+def close():
+    global _journal
+    with _journal_lock:
+        if _journal is not None:
+            _journal.close()
+            _journal = None
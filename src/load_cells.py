@@ -1,4 +1,4 @@
-from .lib.DFRobot_HX711_I2C import *
+from . import hardware
 
 
 SMALL_CUP_WEIGHT = 41.12
@@ -11,24 +11,24 @@ IIC_MODE         = 0x01           # default use IIC1
 IIC_ADDRESS_1    = 0x64           # device 1 address
 IIC_ADDRESS_2    = 0x65           # device 2 address
 
-loadcell1 = DFRobot_HX711_I2C(IIC_MODE, IIC_ADDRESS_1)
-loadcell2 = DFRobot_HX711_I2C(IIC_MODE, IIC_ADDRESS_2)
-
-loadcell1.begin()
-loadcell2.begin()
-
-loadcell1.set_calibration(2142)
-loadcell2.set_calibration(2377)
+CALIBRATIONS = (2142, 2377)
 # from on-chip cal script: (2265, 2315), (2249.37, 2338.22), (2203, 2344)
 # from custom script: (2142, 2377) (2285, 2333)
 
 
+def _load_cells():
+  # The boards are opened on first use (see hardware.py)
+  return hardware.load_cells(IIC_MODE, (IIC_ADDRESS_1, IIC_ADDRESS_2), CALIBRATIONS)
+
+
 def tare():
+  loadcell1, loadcell2 = _load_cells()
   loadcell1.peel()
   loadcell2.peel()
 
 def read():
   # Get the weight of the object
+  loadcell1, loadcell2 = _load_cells()
   data1 = loadcell1.read_weight(5)
   data2 = loadcell2.read_weight(5)
   weight = - (data1 + data2)
@@ -0,0 +1,152 @@
+# Import libraries
+import os
+import time
+import bisect
+import logging
+import threading
+import contextlib
+import collections
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+METRICS_PATH = './data/metrics.prom'
+METRICS_PREFIX = 'cauli'
+# Upper bounds of the histogram buckets (seconds)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Number of recent durations per stage kept for the rolling summary
+ROLLING_WINDOW = 200
+# Number of recent spans kept (stage, start, end, thread name; time.monotonic() clock)
+RECENT_SPANS = 1000
+
+
+class Histogram:
+    # Cumulative Prometheus-style histogram, plus a window of recent values for the rolling summary
+
+    def __init__(self, buckets=BUCKETS, window=None):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        # The window can be widened (ROLLING_WINDOW) before the first observation, e.g. by the benchmarks
+        self.recent = collections.deque(maxlen=window or ROLLING_WINDOW)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def summary(self):
+        values = sorted(self.recent)
+        if not values:
+            return None
+        def percentile(p):
+            return values[min(len(values) - 1, int(p * len(values)))]
+        return {'count': self.count, 'mean': sum(values) / len(values),
+                'p50': percentile(0.50), 'p95': percentile(0.95), 'p99': percentile(0.99), 'max': values[-1]}
+
+
+_lock = threading.Lock()
+_stages = {}        # stage -> Histogram of durations
+_counters = collections.Counter()
+spans = collections.deque(maxlen=RECENT_SPANS)
+
+
+def observe(stage, seconds, start=None):
+    # Record the duration of a stage measured elsewhere (e.g. in the inference worker)
+    end = time.monotonic()
+    with _lock:
+        histogram = _stages.get(stage)
+        if histogram is None:
+            histogram = _stages[stage] = Histogram()
+        histogram.observe(seconds)
+        spans.append((stage, end - seconds if start is None else start, end, threading.current_thread().name))
+
+@contextlib.contextmanager
+def span(stage):
+    # Time the enclosed block as one span of `stage`, whether it succeeds or raises
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(stage, time.monotonic() - start, start)
+
+def increment(event, value=1):
+    # Count an event (e.g. the outcome of a collection cycle)
+    with _lock:
+        _counters[event] += value
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+        spans.clear()
+
+
+def summary():
+    # Rolling summary of the recent durations of every stage: {stage: {count, mean, p50, p95, p99, max}}
+    with _lock:
+        return {stage: histogram.summary() for stage, histogram in sorted(_stages.items())}
+
+def log_summary():
+    lines = [f'{stage:>14}: n={s["count"]:<6} mean={s["mean"]*1000:8.1f}ms p50={s["p50"]*1000:8.1f}ms '
+             f'p95={s["p95"]*1000:8.1f}ms max={s["max"]*1000:8.1f}ms' for stage, s in summary().items() if s]
+    logging.info('Stage timings (rolling):\n' + '\n'.join(lines))
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def prometheus_text():
+    # Metrics in the Prometheus text exposition format
+    name = f'{METRICS_PREFIX}_stage_duration_seconds'
+    lines = [f'# HELP {name} Duration of the collection cycle stages.', f'# TYPE {name} histogram']
+    with _lock:
+        for stage, histogram in sorted(_stages.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {_format_value(histogram.sum)}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        name = f'{METRICS_PREFIX}_events_total'
+        lines += [f'# HELP {name} Collection cycle events.', f'# TYPE {name} counter']
+        for event, count in sorted(_counters.items()):
+            lines.append(f'{name}{{event="{event}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus(path=METRICS_PATH):
+    # Atomic write, for the node_exporter textfile collector (or to be read by hand)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as f:
+        f.write(prometheus_text())
+    os.replace(temporary_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='0.0.0.0'):
+    # Serve the metrics on http://host:port/metrics from a background thread
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='MetricsServer', daemon=True).start()
+    logging.info(f'Serving metrics on http://{host}:{port}/metrics')
+    return server
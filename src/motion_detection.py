@@ -1,9 +1,17 @@
 # Import libraries
 import cv2
-import numpy as np
+
+if __name__ != "__main__":
+    from . import display
+    from . import frame_diff
+if __name__ == "__main__":
+    import display
+    import frame_diff
 
 
 SENSIBILITY = 50_000
+DIFF_DILATION = 5
+DIFF_THRESH = 20
 
 
 def loop(camera, crop_ratio = 1):
@@ -22,44 +30,38 @@ def loop(camera, crop_ratio = 1):
     left_border = int((width/2) - (side_length/2))
     right_border = int((width/2) + (side_length/2))
 
-    previous_frame = None
+    center_roi = (left_border, top_border, right_border - left_border, bottom_border - top_border)
+
+    # Preallocated buffers: two frames (current and previous) and the differencing engine
+    frames = [frame, frame.copy()]
+    differencer = frame_diff.FrameDifferencer(threshold=DIFF_THRESH, dilation=DIFF_DILATION)
     motion_detected = False
+    index = 0
 
     while(not motion_detected):
 
         # Capture the next video frame
-        success, frame = camera.read()
+        index = 1 - index
+        success, frame = camera.read(frames[index])
         if not success:
             print("Camera could not be read")
             break
+        frames[index] = frame
 
         # Slice the initial image
         center_frame = frame[top_border:bottom_border, left_border:right_border]
 
-        # Prepare the image (greyscale + blur to negate noise)
-        prepared_frame = cv2.cvtColor(center_frame, cv2.COLOR_BGR2GRAY)
-        prepared_frame = cv2.GaussianBlur(src=prepared_frame, ksize=(5,5), sigmaX=0)
-
-        if (previous_frame is None):
+        # Thresholded difference with the previous frame (greyscale + blur to negate noise, dilated)
+        thresh_frame = differencer.apply(frame, center_roi)
+        if (thresh_frame is None):
             # First frame; there is no previous one yet
-            previous_frame = prepared_frame
             continue
-            
-        # Calculate difference and update previous frame
-        diff_frame = cv2.absdiff(src1=previous_frame, src2=prepared_frame)
-        previous_frame = prepared_frame
-
-        # Dilate the detected changes to fill in small gaps
-        kernel = np.ones((5, 5))
-        diff_frame = cv2.dilate(diff_frame, kernel, 1)
-
-        # Find if difference is above a certain threshold
-        thresh_frame = cv2.threshold(src=diff_frame, thresh=20, maxval=255, type=cv2.THRESH_BINARY)[1]
 
         # Draw contours of areas that have changed
         contours, _ = cv2.findContours(image=thresh_frame, mode=cv2.RETR_EXTERNAL, method=cv2.CHAIN_APPROX_SIMPLE)
-        cv2.drawContours(image=center_frame, contours=contours, contourIdx=-1, color=(0, 255, 0), thickness=2, lineType=cv2.LINE_AA)
-        cv2.imshow('centerFrameWithContours', center_frame)
+        if display.enabled():
+            cv2.drawContours(image=center_frame, contours=contours, contourIdx=-1, color=(0, 255, 0), thickness=2, lineType=cv2.LINE_AA)
+            display.show('centerFrameWithContours', center_frame)
 
         # Check if there is any significant motion
         for contour in contours:
@@ -73,11 +75,11 @@ def loop(camera, crop_ratio = 1):
         # the 'q' button is set as the
         # quitting button you may use any
         # desired button of your choice
-        if cv2.waitKey(100) & 0xFF == ord('q'):
+        if display.quit_requested():
             break
 
     # Destroy all the windows
-    cv2.destroyAllWindows()
+    display.clear()
 
     return motion_detected
 
@@ -1,36 +1,73 @@
 # import the opencv library
+import os
 import cv2
 import numpy as np
-import tflite_runtime.interpreter as tflite
 import time
 
-
-MODEL_PATH = "./models/model_fp16.tflite"     # EfficientDet0 (float)
+if __name__ != "__main__":
+    from . import inference
+    from . import preprocessing
+    from . import display
+    from . import metrics
+if __name__ == "__main__":
+    import inference
+    import preprocessing
+    import display
+    import metrics
+
+
+# EfficientDet0 models: "fp16" (float input) or "int8" (full-integer quantization, several times
+# faster on the Pi 4 CPU); CAULI_MODEL selects one of them, or gives the path of another model
+# The input and output conversions follow the model's input type and quantization parameters
+MODELS = {
+    'fp16': "./models/model_fp16.tflite",
+    'int8': "./models/model_int8.tflite",
+}
+MODEL = os.environ.get('CAULI_MODEL', 'fp16')
+MODEL_PATH = MODELS.get(MODEL, MODEL)
+NUM_THREADS = 4
 CONFIDENCE_THRESHOLD = 0.50
 CLASS_LABELS = ["cauli", "other"]
 
 
-# Load TFLite model and allocate tensors.
-interpreter = tflite.Interpreter(model_path=MODEL_PATH)
-interpreter.allocate_tensors()
-# Get input tensor details.
-input_details = interpreter.get_input_details()
-input_shape = input_details[0]['shape']
-input_dtype = input_details[0]['dtype']
-# print("input shape:", input_shape)
-# print("input type:", input_dtype)
-
-colors = np.random.uniform(0, 255, size=(len(CLASS_LABELS), 3))
-if input_dtype != np.uint8:
-    colors = colors / 255.0
-
-def detect(interpreter, data):
-    signature_fn = interpreter.get_signature_runner()
-
-    # Feed the input image to the model
-    output = signature_fn(images=data)
-
-    # Get all outputs from the model
+# The TFLite interpreter runs in a dedicated worker process, started by start_service()
+service = None
+preprocessor = None
+input_shape = None
+input_dtype = None
+colors = None
+
+def start_service(model_path=MODEL_PATH, num_threads=NUM_THREADS):
+    global service, preprocessor, input_shape, input_dtype, colors
+    if service is not None:
+        return service
+    service = inference.InferenceService(model_path, num_threads=num_threads)
+    # Get input tensor details.
+    input_shape = service.input_shape
+    input_dtype = service.input_dtype
+    # print("input shape:", input_shape)
+    # print("input type:", input_dtype)
+    # Frames are preprocessed straight into the (shared) input buffer of the model, quantized for
+    # integer models
+    preprocessor = preprocessing.Preprocessor(service.input_buffer, preprocessing.quantization(service.input_details[0]))
+    # Detections are drawn on the resized uint8 BGR image, whatever the model input type
+    colors = np.random.uniform(0, 255, size=(len(CLASS_LABELS), 3))
+    return service
+
+def stop_service():
+    global service
+    if service is not None:
+        service.stop()
+        service = None
+
+def detect(service, data=None):
+    # Feed the input image to the model (None: use what is already in its input buffer)
+    output, latency = service.infer(data)
+    return parse_detections(output)
+
+def parse_detections(output, threshold=CONFIDENCE_THRESHOLD):
+    # Detections of the model outputs whose confidence is at least `threshold`
+    # Boxes are (ymin, xmin, ymax, xmax), relative to the model input
     count = int(np.squeeze(output['output_0']))
     scores = np.squeeze(output['output_1'])
     classes = np.squeeze(output['output_2'])
@@ -38,7 +75,7 @@ def detect(interpreter, data):
 
     results = []
     for i in range(count):
-        if scores[i] >= CONFIDENCE_THRESHOLD:
+        if scores[i] >= threshold:
             result = {
                 'box': boxes[i],
                 'class_id': int(classes[i]),
@@ -76,43 +113,37 @@ def convert_bbox(bbox, original_image_shape, network_input_shape):
 
 def run(camera, tries=3, debug=False):
 
+    start_service()
     converted_bbox = None
     confidence = 0.0
     
     while(tries > 0):
-        # Capture the video frame by frame
-        # First, skip the buffered image
-        success, frame = camera.read()
-        # Then, capture a fresh one
+        # Capture a fresh video frame (the camera grabber never returns a stale buffered one)
         success, frame = camera.read()
         if not success:
             print("Camera could not be read")
-            return None
-
-        # Prepare input data
-        if input_dtype != np.uint8:
-            input_data = cv2.dnn.blobFromImage(image=frame, scalefactor=1/255.0, size=input_shape[1:3], swapRB=True, crop=True)
-            input_data = np.transpose(input_data, (0, 2, 3, 1)).astype(input_dtype)
-        else:
-            input_data = cv2.dnn.blobFromImage(image=frame, scalefactor=1, size=input_shape[1:3], swapRB=True, crop=True)
-            input_data = np.transpose(input_data, (0, 2, 3, 1)).astype(np.uint8)
+            return 0.0, None
 
-        # Retrieve what input image looks like
-        input_reconstructed = cv2.cvtColor(input_data[0], cv2.COLOR_RGB2BGR)
+        # Prepare input data (written in place into the input buffer of the model)
+        # The returned image is what the model sees, in BGR
+        input_image = preprocessor(frame)
 
         # Run model on the input data.
-        start = time.time()
-        detections = detect(interpreter, input_data)
-        end = time.time()
-        print(f"{end-start:.3f}s inference time")
+        start = time.monotonic()
+        detections = detect(service)
+        end = time.monotonic()
+        print(f"{end-start:.3f}s inference time ({service.latencies[-1]:.3f}s in the interpreter)")
+        metrics.observe('inference', end - start)
+        metrics.observe('interpreter', service.latencies[-1])
 
         # Draw detections
         for det in detections:
             print(f" - detected class {det['class_id']} ({det['class_name']}) with confidence {det['confidence']:.2f}")
-            draw_detection(input_reconstructed, det)
+            if display.enabled():
+                draw_detection(input_image, det)
 
         # Show the image with a rectangle surrounding the detected objects 
-        cv2.imshow('detections', input_reconstructed)
+        display.show('detections', input_image)
 
         # Find the detections of 'cauli' object
         cauli_detections = [det for det in detections if det['class_name'] == 'cauli']
@@ -128,21 +159,20 @@ def run(camera, tries=3, debug=False):
         # the 'q' button is set as the
         # quitting button you may use any
         # desired button of your choice
-        if cv2.waitKey(10) & 0xFF == ord('q'):
+        if display.quit_requested():
             break
 
     # Destroy all the windows
-    cv2.destroyAllWindows()
+    display.clear()
 
     return confidence, converted_bbox
 
 
 if __name__ == "__main__":
-    cam = cv2.VideoCapture(2)
-    cam.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cam.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-    cam.set(cv2.CAP_PROP_FPS, 20)
-    cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-    cam.set(cv2.CAP_PROP_AUTOFOCUS, 0)
+    import cameras
+    start_service()
+    cam = cameras.get(2, resolution=(1280,720), fps=20, autofocus=False)
     assert cam.isOpened()
-    run(cam, tries=100, debug=True)
\ No newline at end of file
+    run(cam, tries=100, debug=True)
+    cameras.release_all()
+    stop_service()
\ No newline at end of file
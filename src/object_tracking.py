@@ -1,12 +1,25 @@
 # Import libraries
 import time
+import queue
+import logging
+import threading
 import cv2
 import numpy as np
 
 if __name__ != "__main__":
     from . import iris
+    from . import display
+    from . import boxes
+    from . import frame_diff
+    from . import metrics
+    from . import object_detection
 if __name__ == "__main__":
     import iris
+    import display
+    import boxes
+    import frame_diff
+    import metrics
+    import object_detection
 
 
 DIFF_DILATION = 3
@@ -21,152 +34,295 @@ ALLOWED_DIM_REDUCTION_FACTOR = 0.6
 ALLOWED_DIM_AUGMENTATION_FACTOR = 3.0
 ALLOWED_MAX_SCREEN_PORTION = 0.80
 
-# Find the bounding box that encompasses all the bounding boxes
-def find_global_bounding_box(bounding_boxes):
-    # Find the top left corner
-    x1 = min([box[0] for box in bounding_boxes])
-    y1 = min([box[1] for box in bounding_boxes])
-    # Find the bottom right corner
-    x2 = max([box[0] + box[2] for box in bounding_boxes])
-    y2 = max([box[1] + box[3] for box in bounding_boxes])
-    # Return the bounding box
-    return (x1, y1, x2-x1, y2-y1)
-
-# Compute the intersection of two bounding boxes
-def find_intersection(box1, box2):
-    # Find the top left corner
-    x1 = max(box1[0], box2[0])
-    y1 = max(box1[1], box2[1])
-    # Find the bottom right corner
-    x2 = min(box1[0] + box1[2], box2[0] + box2[2])
-    y2 = min(box1[1] + box1[3], box2[1] + box2[3])
-    # Return the bounding box if the intersection is valid; otherwise return None
-    if (x1 < x2) and (y1 < y2):
-        return (x1, y1, x2-x1, y2-y1)
-    else:
-        return None
-
-# Compute the area of the intersection of two bounding boxes
-def compute_intersection_area(box1, box2):
-    # Find the intersection
-    intersection_box = find_intersection(box1, box2)
-    # Return the area if there is an intersection
-    if (intersection_box is not None):
-        return intersection_box[2] * intersection_box[3]
-    else:
-        return 0
-
-# Compute the percentage of the overlapping box that is inside the box
-def percentage_inside(overlapping_box, box):
-    # Find the intersection area
-    intersect_area = compute_intersection_area(overlapping_box, box)
-    # Find the area of the overlapping box
-    overlapping_box_area = overlapping_box[2] * overlapping_box[3]
-    # Return the percentage
-    return intersect_area / overlapping_box_area
-
-# Expand a box by a certain factor
-def expand_box(box, expansion_factor):
-    # Find the center of the box
-    center_x = box[0] + (box[2] / 2)
-    center_y = box[1] + (box[3] / 2)
-    # Find the new width and height
-    new_width = box[2] * expansion_factor
-    new_height = box[3] * expansion_factor
-    # Find the new top left corner
-    new_x = center_x - (new_width / 2)
-    new_y = center_y - (new_height / 2)
-    # Return the new box
-    return (new_x, new_y, new_width, new_height)
-
-
-def track_and_open_iris(camera, tracking_box, timer, iris_open_delay, debug=False):
-
-    end_time = time.time() + timer
-    iris_open_time = time.time() + iris_open_delay
-    iris_stop_time = iris_open_time + iris.OPEN_DURATION
-    iris_opened = False
-    iris_stopped = False
-    pwm = None
-
-    assert (end_time > iris_stop_time) and (iris_stop_time > iris_open_time)
-
-    previous_frame = None
+PIPELINE_DEPTH = 2
+# Frames in flight: two queues, one frame in each of the contour and association stages,
+# the frame being captured and the previous frame kept by the differencing engine
+FRAME_POOL_SIZE = 2 * PIPELINE_DEPTH + 4
+
+# Motion is analysed on a downscaled image (number of pyramid levels, 0 for full resolution),
+# restricted to a region around the tracking box (the search box expanded by this factor: larger
+# motion would be rejected by ALLOWED_DIM_AUGMENTATION_FACTOR anyway)
+DOWNSCALE_LEVELS = 1
+USE_ROI = True
+ROI_EXPANSION_FACTOR = 3.0
+ROI_ALIGNMENT = 32
+
+# Uncertainty levels used by validate(), in frames and in seconds (the frame counts at 20 fps)
+UNCERTAIN_FRAMES = (3, 8, 15)
+UNCERTAIN_DURATIONS = (0.15, 0.40, 0.75)
+
+# Fused tracking: while tracking, the detector runs in the background on one frame every
+# REDETECTION_INTERVAL frames (one detection at a time, when the detection service is running);
+# a detection, moved by the motion tracked since its frame, replaces the motion-based box if it
+# is mostly within the tracking box expanded by REDETECTION_SEARCH_FACTOR
+# Detections older than MAX_DETECTION_AGE seconds are dropped: tracking goes on from motion alone
+FUSED_TRACKING = True
+REDETECTION_INTERVAL = 5
+REDETECTION_SEARCH_FACTOR = 2.0
+REDETECTION_MIN_INSIDE = 0.5
+MAX_DETECTION_AGE = 0.75
+
+
+class PipelineStage(threading.Thread):
+    # Run `function` on each item of the input queue (or on None, for a source stage)
+    # and push its results to the output queue, so that consecutive stages overlap across threads
+
+    def __init__(self, name, function, input_queue, output_queue, stop_event):
+        super().__init__(name=name, daemon=True)
+        self.function = function
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stop_event = stop_event
+
+    def run(self):
+        while not self.stop_event.is_set():
+            item = None
+            if self.input_queue is not None:
+                try:
+                    item = self.input_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            result = self.function(item)
+            if result is None:
+                continue
+            # Block while the next stage is busy (the camera grabber keeps the freshest frame meanwhile)
+            while not self.stop_event.is_set():
+                try:
+                    self.output_queue.put(result, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+
+def search_roi(tracking_box, frame_shape, expansion_factor=ROI_EXPANSION_FACTOR, alignment=ROI_ALIGNMENT):
+    # Region of the frame around the tracking box where motion is analysed,
+    # aligned so that small moves of the box do not change it
+    height, width = frame_shape[:2]
+    x, y, w, h = boxes.expand(tracking_box, expansion_factor)
+    x1 = max(0, int(x) // alignment * alignment)
+    y1 = max(0, int(y) // alignment * alignment)
+    x2 = min(width, -(-int(np.ceil(x + w)) // alignment) * alignment)
+    y2 = min(height, -(-int(np.ceil(y + h)) // alignment) * alignment)
+    if (x2 <= x1) or (y2 <= y1):
+        # The tracking box left the frame: analyse all of it
+        return (0, 0, width, height)
+    return (x1, y1, x2 - x1, y2 - y1)
+
+
+def make_diff_stage(camera, shared, levels=DOWNSCALE_LEVELS, use_roi=USE_ROI):
+    # Capture + differencing stage: (timestamp, frame, thresholded difference, ROI origin, scale)
+    # The difference is computed on the ROI around the latest tracking box (shared['tracking_box']),
+    # downscaled `levels` times; a None frame means that the camera could not be read
+    # Frames and thresholded images come from pools large enough to cover every item in flight
+    # in the pipeline, so that no image is allocated once the pools are filled
+    frames = [None] * FRAME_POOL_SIZE
+    differencer = frame_diff.FrameDifferencer(threshold=DIFF_THRESH, dilation=DIFF_DILATION, levels=levels, outputs=PIPELINE_DEPTH + 2)
+    state = {'index': 0}
+    scale = 2 ** levels
+
+    def diff_stage(_):
+        # Capture the video frame by frame, into the next frame of the pool
+        index = state['index'] = (state['index'] + 1) % FRAME_POOL_SIZE
+        success, frame, timestamp = camera.read_new(image=frames[index])
+        if not success:
+            print("Camera could not be read")
+            return (time.monotonic(), None, None, None, None)
+        frames[index] = frame
+
+        if use_roi:
+            roi = search_roi(shared['tracking_box'], frame.shape)
+        else:
+            roi = (0, 0, frame.shape[1], frame.shape[0])
+
+        # Thresholded difference with the previous frame
+        thresh_frame = differencer.apply(frame, roi)
+        if (thresh_frame is None):
+            # First frame; there is no previous one yet
+            return None
+        return (timestamp, frame, thresh_frame, roi[:2], scale)
+
+    return diff_stage
+
+def contour_stage(item):
+    # Contour stage: (timestamp, frame, contours, bounding boxes in full resolution coordinates, ROI origin, scale)
+    timestamp, frame, thresh_frame, origin, scale = item
+    if frame is None:
+        return (timestamp, None, None, None, None, None)
+
+    # Find the contours of areas that have changed
+    contours, _ = cv2.findContours(image=thresh_frame, mode=cv2.RETR_EXTERNAL, method=cv2.CHAIN_APPROX_SIMPLE)
+
+    # Check if there is any significant motion (areas are measured in the downscaled image)
+    min_area = MIN_CONTOUR_AREA / (scale ** 2)
+    contours = [c for c in contours if cv2.contourArea(c) > min_area]
+    bounding_boxes = boxes.to_array([cv2.boundingRect(c) for c in contours])
+
+    # Map the boxes back to full resolution coordinates
+    bounding_boxes *= scale
+    bounding_boxes[:, :2] += origin
+    return (timestamp, frame, contours, bounding_boxes, origin, scale)
+
+
+class Redetector:
+    # Background re-detection for the fused tracking mode, on the detection service of
+    # object_detection: submit() preprocesses a frame into the input buffer of the model and
+    # starts the inference asynchronously, poll() returns its result once it is done
+    # The tracking loop never waits for the detector
+
+    def __init__(self, interval=REDETECTION_INTERVAL, max_age=MAX_DETECTION_AGE):
+        self.service = object_detection.service
+        self.interval = interval
+        self.max_age = max_age
+        self.frames = 0
+        self.pending = None     # (future, frame timestamp, frame shape, tracking box on that frame)
+        self.stats = {'submitted': 0, 'applied': 0, 'rejected': 0, 'late': 0, 'missed': 0}
+
+    def enabled(self):
+        return self.service is not None
+
+    def submit(self, frame, timestamp, tracking_box):
+        # Count the frame, and start a detection on it if it is time and none is in flight
+        # (the input buffer must not change during an inference)
+        self.frames += 1
+        if (not self.enabled()) or (self.pending is not None) or (self.frames < self.interval):
+            return
+        self.frames = 0
+        object_detection.preprocessor(frame)
+        self.pending = (self.service.infer_async(), timestamp, frame.shape, tracking_box)
+        self.stats['submitted'] += 1
+
+    def poll(self):
+        # Best 'cauli' detection of the finished inference, if any: (box in frame coordinates,
+        # confidence, frame timestamp, tracking box on that frame); None otherwise
+        if (self.pending is None) or (not self.pending[0].done()):
+            return None
+        future, timestamp, frame_shape, tracking_box = self.pending
+        self.pending = None
+        try:
+            output, _ = future.result()
+        except Exception as e:
+            # Fall back to motion alone for the rest of the tracking
+            logging.warning(f'Re-detection failed, tracking from motion only: {e}')
+            self.service = None
+            return None
+        age = float(time.monotonic() - timestamp)
+        metrics.observe('redetection_age', age)
+        if age > self.max_age:
+            self.stats['late'] += 1
+            return None
+        detections = [det for det in object_detection.parse_detections(output) if det['class_name'] == 'cauli']
+        if len(detections) == 0:
+            # e.g. the object is falling through the trapdoor
+            self.stats['missed'] += 1
+            return None
+        candidates = boxes.to_array([object_detection.convert_bbox(det['box'], frame_shape, object_detection.input_shape)
+                                     for det in detections])
+        # The detection that overlaps the tracked object the most, then the most confident one
+        best = max(range(len(detections)), key=lambda i: (float(boxes.iou(candidates[i], tracking_box)), detections[i]['confidence']))
+        return candidates[best], detections[best]['confidence'], timestamp, tracking_box
+
+    def fuse(self, tracking_box, detection):
+        # Move the detected box by the motion tracked since its frame; returns the fused box, or
+        # None if it is too far from the tracking box (another object, or a wrong detection)
+        box, confidence, timestamp, detection_tracking_box = detection
+        shift = boxes.center(tracking_box) - boxes.center(detection_tracking_box)
+        fused = box.copy()
+        fused[:2] += shift
+        search_box = boxes.expand(tracking_box, REDETECTION_SEARCH_FACTOR)
+        if boxes.percentage_inside(fused, search_box) < REDETECTION_MIN_INSIDE:
+            self.stats['rejected'] += 1
+            return None
+        self.stats['applied'] += 1
+        return boxes.to_tuple(fused)
+
+    def cancel(self, timeout=1.0):
+        # Wait for the detection in flight, so that the next user of the service finds it idle
+        if self.pending is not None:
+            try:
+                self.pending[0].result(timeout=timeout)
+            except Exception:
+                pass
+            self.pending = None
+
+
+def track_and_open_iris(camera, tracking_box, timer, iris_open_delay, debug=False, downscale_levels=DOWNSCALE_LEVELS, use_roi=USE_ROI, fusion=FUSED_TRACKING):
+    # `camera` must provide read_new() (see cameras.Camera), which returns capture timestamps
+    # Returns the final tracking box, the frame dimensions, the uncertainty (number of frames where
+    # tracking was uncertain) and the history of (timestamp, tracking box, status) for every frame
+
+    start_time = time.monotonic()
+    end_time = start_time + timer
+
+    # The iris is driven by its own timer thread
+    iris_control = iris.ScheduledOpening(start_time + iris_open_delay, iris.OPEN_DURATION)
+    assert (end_time > iris_control.open_time + iris_control.duration)
+    iris_control.start()
+
+    # Pipeline: capture (camera grabber) -> diff -> contours -> association (this thread)
+    stop_event = threading.Event()
+    shared = {'tracking_box': tracking_box}
+    diff_queue = queue.Queue(maxsize=PIPELINE_DEPTH)
+    contour_queue = queue.Queue(maxsize=PIPELINE_DEPTH)
+    stages = [
+        PipelineStage('TrackingDiff', make_diff_stage(camera, shared, downscale_levels, use_roi), None, diff_queue, stop_event),
+        PipelineStage('TrackingContours', contour_stage, diff_queue, contour_queue, stop_event),
+    ]
+    for stage in stages:
+        stage.start()
+
+    # Fused tracking: periodic re-detection, when the detection service is running
+    redetector = Redetector() if fusion else None
+    if (redetector is not None) and not redetector.enabled():
+        redetector = None
+
     uncertainty = 0
+    history = []
     cam_height, cam_width = 0, 0
 
-    iter_time = time.time()
+    iter_time = time.monotonic()
 
     while(iter_time < end_time):
 
-        if (time.time() > iris_stop_time) and not iris_stopped:
-            iris_stopped = True
-            iris.stop(pwm)
-
-        if (time.time() > iris_open_time) and not iris_opened:
-            iris_opened = True
-            pwm = iris.open_continuously()
+        try:
+            timestamp, frame, contours, bounding_boxes, origin, scale = contour_queue.get(timeout=end_time - iter_time)
+        except queue.Empty:
+            break
 
-        # Capture the video frame by frame
-        success, frame = camera.read()
-        if not success:
-            print("Camera could not be read")
+        if frame is None:
             uncertainty += 1
+            history.append((timestamp, tracking_box, 'uncertain'))
+            iter_time = time.monotonic()
             continue
-        
-        cam_height, cam_width, _ = frame.shape
-        
-        # Prepare the image (greyscale + blur to negate noise)
-        prepared_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        prepared_frame = cv2.GaussianBlur(src=prepared_frame, ksize=(5,5), sigmaX=0)
 
-        if (previous_frame is None):
-            # First frame; there is no previous one yet
-            previous_frame = prepared_frame
-            continue
-            
-        # Calculate difference and update previous frame
-        diff_frame = cv2.absdiff(src1=previous_frame, src2=prepared_frame)
-        previous_frame = prepared_frame
-
-        # Dilate the detected changes to fill in small gaps
-        kernel = np.ones((DIFF_DILATION, DIFF_DILATION))
-        diff_frame = cv2.dilate(diff_frame, kernel, 1)
-
-        # Find if difference is above a certain threshold
-        thresh_frame = cv2.threshold(src=diff_frame, thresh=DIFF_THRESH, maxval=255, type=cv2.THRESH_BINARY)[1]
-
-        # Draw contours of areas that have changed
-        contours, _ = cv2.findContours(image=thresh_frame, mode=cv2.RETR_EXTERNAL, method=cv2.CHAIN_APPROX_SIMPLE)
+        cam_height, cam_width, _ = frame.shape
 
-        # Check if there is any significant motion
-        contours = [c for c in contours if cv2.contourArea(c) > MIN_CONTOUR_AREA]
-        bounding_boxes = [cv2.boundingRect(c) for c in contours]
-        
-        if debug:
-            # Draw contours
+        if debug and display.enabled():
+            # Draw contours (mapped back to full resolution)
             c_frame = frame.copy()
+            contours = [c * scale + origin for c in contours]
             cv2.drawContours(image=c_frame, contours=contours, contourIdx=-1, color=(0, 255, 0), thickness=2, lineType=cv2.LINE_AA)
-            cv2.imshow('MotionContours', c_frame)
+            display.show('MotionContours', c_frame)
             # Draw the bounding boxes on the frame
             b_frame = frame.copy()
-            for box in bounding_boxes:
+            for box in bounding_boxes.astype(int):
                 x, y, w, h = box
                 cv2.rectangle(b_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-            cv2.imshow('MotionBoundingBoxes', b_frame)
+            display.show('MotionBoundingBoxes', b_frame)
         
-        # Find all the bounding boxes that overlap more that 50% with the expanded tracking box
-        search_box = expand_box(tracking_box, SEARCH_EXPANSION_FACTOR)
-        intersecting_boxes = [current_bbox for current_bbox in bounding_boxes
-                            if (percentage_inside(current_bbox, search_box) > FRAGMENTED_BOX_OVERLAP_W_SEARCH)
-                            or (percentage_inside(search_box, current_bbox) > SEARCH_OVERLAP_W_BIG_MOTION)]
+        # Find all the bounding boxes that are mostly inside the expanded tracking box,
+        # or that contain most of it (all the boxes of the frame at once)
+        search_box = boxes.expand(tracking_box, SEARCH_EXPANSION_FACTOR)
+        intersecting = ((boxes.percentage_inside(bounding_boxes, search_box) > FRAGMENTED_BOX_OVERLAP_W_SEARCH)
+                        | (boxes.percentage_inside(search_box, bounding_boxes) > SEARCH_OVERLAP_W_BIG_MOTION))
+        intersecting_boxes = bounding_boxes[intersecting]
 
         # Find the bounding box that encompasses all the intersecting boxes
         allowed_max_area = ALLOWED_MAX_SCREEN_PORTION * cam_width * cam_height
 
         tracking_succeeded = False
+        status = 'no_motion'
         if (len(intersecting_boxes) > 0):
-            candidate_tracking_box = find_global_bounding_box(intersecting_boxes)
+            candidate_tracking_box = boxes.to_tuple(boxes.union(intersecting_boxes))
             # Use the global box if it is not significantly smaller than the tracking box
             # and is not not big with regards to the camera frame
             if ((candidate_tracking_box[2] > ALLOWED_DIM_REDUCTION_FACTOR * tracking_box[2])
@@ -176,42 +332,78 @@ def track_and_open_iris(camera, tracking_box, timer, iris_open_delay, debug=Fals
             and (candidate_tracking_box[2] * candidate_tracking_box[3] < allowed_max_area)):
                 tracking_box = candidate_tracking_box
                 tracking_succeeded = True
+                status = 'tracked'
             else:
                 # Failed to find a valid update, increase uncertainty
                 uncertainty += 1 
+                status = 'uncertain'
         else:
             # No intersecting boxes; use the previous tracking box
             pass
 
-        # Draw the updated tracking box
-        t_frame = frame.copy()
-        
-        if debug:
-            for box in intersecting_boxes:
-                colour = (0,255,0) if tracking_succeeded else (0,0,255)
-                cv2.rectangle(t_frame, (int(box[0]), int(box[1])), (int(box[0] + box[2]), int(box[1] + box[3])), colour, 2)
-            
-        cv2.rectangle(t_frame, (int(tracking_box[0]), int(tracking_box[1])), (int(tracking_box[0] + tracking_box[2]), int(tracking_box[1] + tracking_box[3])), (255, 0, 0), 3)
-        cv2.imshow('Tracking Box', t_frame)
+        # Correct the motion-based box with the latest detection, and start the next one
+        if redetector is not None:
+            detection = redetector.poll()
+            if detection is not None:
+                fused_box = redetector.fuse(tracking_box, detection)
+                if fused_box is not None:
+                    tracking_box = fused_box
+                    status = 'redetected'
+            redetector.submit(frame, timestamp, tracking_box)
+
+        history.append((timestamp, tracking_box, status))
+        # Let the diff stage move its ROI
+        shared['tracking_box'] = tracking_box
+
+        # Draw the updated tracking box on a copy: the diff stage keeps this frame as its previous
+        # frame, and prepares it again whenever the ROI moves
+        if display.enabled():
+            t_frame = frame.copy()
+
+            if debug:
+                for box in intersecting_boxes:
+                    colour = (0,255,0) if tracking_succeeded else (0,0,255)
+                    cv2.rectangle(t_frame, (int(box[0]), int(box[1])), (int(box[0] + box[2]), int(box[1] + box[3])), colour, 2)
+
+            cv2.rectangle(t_frame, (int(tracking_box[0]), int(tracking_box[1])), (int(tracking_box[0] + tracking_box[2]), int(tracking_box[1] + tracking_box[3])), (255, 0, 0), 3)
+            display.show('Tracking Box', t_frame)
 
         if debug:
-            print("fps:", (1/(time.time()-iter_time)))
+            print("fps:", (1/(time.monotonic()-iter_time)), "latency:", (time.monotonic()-timestamp))
 
-        iter_time = time.time()
+        iter_time = time.monotonic()
 
         # the 'q' button is set as the
         # quitting button you may use any
         # desired button of your choice
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        if display.quit_requested():
             break
 
+    # Stop the pipeline, and the iris if the tracking ended before it was stopped
+    stop_event.set()
+    for stage in stages:
+        stage.join()
+    iris_control.cancel()
+    if redetector is not None:
+        redetector.cancel()
+        logging.debug(f'Re-detection during tracking: {redetector.stats}')
+
     # Destroy all the windows
-    cv2.destroyAllWindows()
+    display.clear()
+
+    return tracking_box, (cam_height, cam_width), uncertainty, history
 
-    return tracking_box, (cam_height, cam_width), uncertainty
 
+def uncertain_duration(history):
+    # Total time during which the tracking was uncertain
+    duration = 0.0
+    for previous, current in zip(history, history[1:]):
+        if current[2] == 'uncertain':
+            duration += current[0] - previous[0]
+    return duration
 
-def validate(bbox, dims, uncertainty):
+
+def validate(bbox, dims, uncertainty, history=None):
 
     height = dims[0]
     width = dims[1]
@@ -227,19 +419,27 @@ def validate(bbox, dims, uncertainty):
     print("tracking result:", bbox, dims, uncertainty)
     print("center of tracking box:", x_center, y_center)
 
-    if uncertainty > 15:
+    # Reason in time when the timestamped history is available, in frames otherwise
+    if history is not None:
+        uncertain_time = uncertain_duration(history)
+        print(f"tracking was uncertain for {uncertain_time:.2f}s")
+        high, medium, low = [uncertain_time > limit for limit in reversed(UNCERTAIN_DURATIONS)]
+    else:
+        high, medium, low = [uncertainty > limit for limit in reversed(UNCERTAIN_FRAMES)]
+
+    if high:
         if (ymin <= 5) or (y_center <= 0.25 * height):
             return False
         if (x_center <= 0.10 * width) or (x_center >= 0.90 * width):
             return False
         
-    elif uncertainty > 8:
+    elif medium:
         if (ymin <= 0.05 * height) or (y_center <= 0.33 * height):
             return False
         if (x_center <= 0.15 * width) or (x_center >= 0.85 * width):
             return False
         
-    elif uncertainty > 3:
+    elif low:
         if (ymin <= 0.10 * height) or (y_center <= 0.45 * height):
             return False
         if (x_center <= 0.20 * width) or (x_center >= 0.80 * width):
@@ -256,10 +456,8 @@ def validate(bbox, dims, uncertainty):
 
 
 if __name__ == "__main__":
-    camera = cv2.VideoCapture(2)
-    camera.set(cv2.CAP_PROP_FPS, 20)
-    camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-    camera.set(cv2.CAP_PROP_AUTOFOCUS, 0)
+    import cameras
+    camera = cameras.get(2, fps=20, autofocus=False)
     assert camera.isOpened()
     # Read first frame.
     success, first_frame = camera.read()
@@ -269,7 +467,7 @@ if __name__ == "__main__":
         sys.exit()
     # Select a bounding box
     bbox = cv2.selectROI(first_frame, False)
-    print(track_and_open_iris(camera, tracking_box=bbox, timer=100, iris_open_delay=10, debug=True))
+    print(track_and_open_iris(camera, tracking_box=bbox, timer=100, iris_open_delay=10, debug=True)[:3])
     iris.close()
-    camera.release()
+    cameras.release_all()
     iris.cleanup()
\ No newline at end of file
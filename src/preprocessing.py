@@ -0,0 +1,76 @@
+# Import libraries
+import cv2
+import numpy as np
+
+
+# Float models take RGB values in [0, 1]
+INPUT_NORMALISATION = 1/255.0
+
+
+def quantization(details):
+    # (scale, zero point) of a tensor from its TFLite details, None if it is not quantized
+    scale, zero_point = details.get('quantization', (0.0, 0))
+    if not scale:
+        return None
+    return float(scale), int(zero_point)
+
+def quantization_lut(dtype, quantization, normalisation=INPUT_NORMALISATION):
+    # Lookup table from pixel values to the integer input of a quantized model, as raw bytes:
+    # q = round(pixel * normalisation / scale + zero point), i.e. the quantized value of what the
+    # float model would see; models without quantization parameters take the pixels as they are
+    # (shifted by 128 for int8 models)
+    info = np.iinfo(dtype)
+    pixels = np.arange(256, dtype=np.float64)
+    if quantization is None:
+        values = pixels + info.min
+    else:
+        scale, zero_point = quantization
+        values = np.round(pixels * normalisation / scale + zero_point)
+    return np.clip(values, info.min, info.max).astype(dtype).view(np.uint8)
+
+
+class Preprocessor:
+    # Center-crop, resize and convert camera frames straight into the (preallocated) NHWC input
+    # buffer of the model: equivalent to cv2.dnn.blobFromImage(..., swapRB=True, crop=True) up to
+    # interpolation, since the frame is cropped before being resized (blobFromImage resizes, then crops)
+    # The conversion follows the input type: scaled to [0, 1] for float models, quantized with the
+    # input (scale, zero point) for integer models (`quantization`, see quantization())
+
+    def __init__(self, input_buffer, quantization=None, normalisation=INPUT_NORMALISATION):
+        self.input_buffer = input_buffer
+        self.height, self.width = input_buffer.shape[1:3]
+        self.is_float = np.issubdtype(input_buffer.dtype, np.floating)
+        # Integer models: raw pixels need no conversion at all, other quantizations go through a LUT
+        self.lut = None if self.is_float else quantization_lut(input_buffer.dtype, quantization, normalisation)
+        self.is_raw = (self.lut is not None) and np.array_equal(self.lut, np.arange(256, dtype=np.uint8))
+        # Resized BGR image: this is also what the model sees, so it doubles as the display image
+        self.resized = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        # RGB image: written directly into the input buffer for models that take raw pixels
+        self.rgb = input_buffer[0] if self.is_raw else np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.scale = normalisation
+        self._frame_shape = None
+        self._crop = None
+
+    def crop_slices(self, frame_shape):
+        # Center crop with the aspect ratio of the model input (cached per frame shape)
+        if frame_shape[:2] != self._frame_shape:
+            frame_height, frame_width = frame_shape[:2]
+            ratio = min(frame_height / self.height, frame_width / self.width)
+            crop_height = int(round(self.height * ratio))
+            crop_width = int(round(self.width * ratio))
+            top = (frame_height - crop_height) // 2
+            left = (frame_width - crop_width) // 2
+            self._crop = (slice(top, top + crop_height), slice(left, left + crop_width))
+            self._frame_shape = frame_shape[:2]
+        return self._crop
+
+    def __call__(self, frame):
+        # Fill the input buffer from `frame` and return the resized BGR image fed to the model
+        rows, cols = self.crop_slices(frame.shape)
+        cv2.resize(frame[rows, cols], (self.width, self.height), dst=self.resized, interpolation=cv2.INTER_LINEAR)
+        cv2.cvtColor(self.resized, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        if self.is_float:
+            np.multiply(self.rgb, self.scale, out=self.input_buffer[0], casting='unsafe')
+        elif not self.is_raw:
+            cv2.LUT(self.rgb, self.lut, dst=self.input_buffer[0].view(np.uint8))
+        return self.resized
@@ -1,22 +1,318 @@
 # Import libraries
 import time
+import threading
+import collections
 import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pyzbar import pyzbar
 from pyzbar.pyzbar import ZBarSymbol
 
+if __name__ != "__main__":
+    from . import display
+    from .qr_payload import TYPES, process, process_many
+if __name__ == "__main__":
+    import display
+    from qr_payload import TYPES, process, process_many
+
 
 REPEATED_DETECTIONS = 3
+# A code is accepted once it has been decoded REPEATED_DETECTIONS times within this window (seconds)
+CONFIRMATION_WINDOW = 2.0
+
+# Candidate regions are localised on the crop downscaled by this factor, then decoded at full resolution
+LOCALISATION_SCALE = 0.5
+# Margin added around a localised code, as a fraction of its size
+ROI_MARGIN = 0.25
+# Number of consecutive frames without a decode before a tracked region is dropped
+ROI_MAX_MISSES = 3
+# Most frames have no code at all: without a localised candidate, the whole image is only decoded
+# once every this many frames
+FULL_DECODE_INTERVAL = 5
+
+# Parallel decoding: the region of every frame found by QRDetector is decoded in several
+# preprocessed variants by a pool of threads (pyzbar and OpenCV release the GIL), and the decodes
+# of all the workers are voted on
+PARALLEL_DECODING = True
+DECODE_WORKERS = 4
+DECODE_VARIANTS = ('gray', 'clahe', 'sharpened', 'binarised')
+# Decodes of a frame that are not finished this long after the frame was captured are dropped (seconds)
+FRAME_DEADLINE = 0.5
+# Maximum number of frames being decoded at the same time
+MAX_FRAMES_IN_FLIGHT = DECODE_WORKERS
+
+
+class ConfidencePolicy:
+    # Accept a code once it has been decoded `required` times within `window` seconds
+
+    def __init__(self, required=REPEATED_DETECTIONS, window=CONFIRMATION_WINDOW):
+        self.required = required
+        self.window = window
+        self.decodes = {}
+
+    def add(self, code_info, timestamp):
+        # Record a decode, and return whether the code is now confirmed
+        timestamps = self.decodes.setdefault(code_info, collections.deque())
+        timestamps.append(timestamp)
+        while timestamp - timestamps[0] > self.window:
+            timestamps.popleft()
+        return len(timestamps) >= self.required
+
+
+class QRDetector:
+    # QR code detection engine: localise the code on a downscaled image (or reuse the region where
+    # it was decoded in the previous frames), then decode only that region at full resolution
+    # Falls back to decoding the whole image when a candidate could not be decoded in its region,
+    # and every `full_interval` frames when no candidate is found
+
+    def __init__(self, scale=LOCALISATION_SCALE, margin=ROI_MARGIN, max_misses=ROI_MAX_MISSES,
+                 full_interval=FULL_DECODE_INTERVAL):
+        self.scale = scale
+        self.margin = margin
+        self.max_misses = max_misses
+        self.full_interval = full_interval
+        self.localiser = cv2.QRCodeDetector()
+        self.roi = None
+        self.misses = 0
+        # The first frame without a candidate is decoded whole
+        self.since_full = full_interval
+        self._shape = None
+
+    def _allocate(self, shape):
+        height, width = shape[:2]
+        self.gray = np.empty((height, width), dtype=np.uint8)
+        self.small = np.empty((max(1, int(height * self.scale)), max(1, int(width * self.scale))), dtype=np.uint8)
+        self._shape = shape
+
+    def _expand(self, x, y, w, h):
+        # Region around a code, with a margin, clipped to the image
+        height, width = self.gray.shape
+        margin_x, margin_y = int(w * self.margin), int(h * self.margin)
+        x1, y1 = max(0, x - margin_x), max(0, y - margin_y)
+        x2, y2 = min(width, x + w + margin_x), min(height, y + h + margin_y)
+        if (x2 <= x1) or (y2 <= y1):
+            return None
+        return (x1, y1, x2 - x1, y2 - y1)
+
+    def localise(self):
+        # Find a candidate region on the downscaled image
+        cv2.resize(self.gray, (self.small.shape[1], self.small.shape[0]), dst=self.small, interpolation=cv2.INTER_AREA)
+        found, points = self.localiser.detect(self.small)
+        if not found or points is None:
+            return None
+        x, y, w, h = cv2.boundingRect((points.reshape(-1, 2) / self.scale).astype(np.float32))
+        return self._expand(x, y, w, h)
+
+    def _decode(self, roi):
+        # Decode a region of the greyscale image: [(data, rect in image coordinates)]
+        x, y, w, h = roi
+        qrcodes = pyzbar.decode(self.gray[y:y+h, x:x+w], symbols=[ZBarSymbol.QRCODE])
+        return [(qrcode.data.decode('utf-8'), (x + qrcode.rect[0], y + qrcode.rect[1], qrcode.rect[2], qrcode.rect[3])) for qrcode in qrcodes]
+
+    def _prepare(self, image):
+        # Greyscale copy of `image` (BGR) in the preallocated buffer
+        if image.shape != self._shape:
+            self._allocate(image.shape)
+            self.roi = None
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+    def _full_region(self, force=False):
+        # The whole image, if it is due to be decoded (or `force`d); None otherwise
+        self.since_full += 1
+        if not force and self.since_full < self.full_interval:
+            return None
+        self.since_full = 0
+        return (0, 0, self.gray.shape[1], self.gray.shape[0])
+
+    def region(self, image):
+        # Region of `image` (BGR) to decode in this frame (the greyscale image is left in self.gray):
+        # the tracked region, else a localised one, else the whole image when it is due; None to skip
+        self._prepare(image)
+        if self.roi is not None:
+            return self.roi
+        roi = self.localise()
+        return roi if roi is not None else self._full_region()
+
+    def decode(self, image):
+        # Find and decode QR codes in `image` (BGR): [(data, (x, y, w, h))]
+        self._prepare(image)
+
+        results = []
+        tracked = self.roi is not None
+        roi = self.roi if tracked else self.localise()
+        if roi is not None:
+            results = self._decode(roi)
+        if not results and tracked:
+            # The code may have moved out of the tracked region: localise it again
+            roi = self.localise()
+            if roi is not None:
+                results = self._decode(roi)
+        if not results:
+            # Nothing was decoded: decode the whole image straight away if a candidate was found,
+            # and otherwise only when it is due
+            full = self._full_region(force=roi is not None)
+            if full is not None:
+                results = self._decode(full)
+
+        self.track(results)
+        return results
+
+    def track(self, results):
+        # Track the region of the first decoded code in the next frames, or count a miss
+        if results:
+            self.roi = self._expand(*results[0][1])
+            self.misses = 0
+        elif self.roi is not None:
+            self.misses += 1
+            if self.misses > self.max_misses:
+                self.roi = None
+
+
+_clahe = threading.local()
+
+def _equalise(gray):
+    # CLAHE objects are not thread-safe: one per worker
+    if not hasattr(_clahe, 'clahe'):
+        _clahe.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return _clahe.clahe.apply(gray)
+
+SHARPEN_KERNEL = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]], dtype=np.float32)
+
+# Preprocessed variants of the greyscale image, to help decoding codes affected by glare or blur
+VARIANTS = {
+    'gray': lambda gray: gray,
+    'clahe': _equalise,
+    'sharpened': lambda gray: cv2.filter2D(gray, -1, SHARPEN_KERNEL),
+    'binarised': lambda gray: cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 5),
+}
+
+_decode_executor = None
+
+def _get_decode_executor():
+    # Long-lived pool, created on first use
+    global _decode_executor
+    if _decode_executor is None:
+        _decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='qr_decode')
+    return _decode_executor
 
+def _decode_variant(gray, variant, origin=(0, 0)):
+    # Decode one preprocessed variant of a greyscale region at `origin`: [(data, rect in image coordinates)]
+    qrcodes = pyzbar.decode(VARIANTS[variant](gray), symbols=[ZBarSymbol.QRCODE])
+    return [(qrcode.data.decode('utf-8'), (origin[0] + qrcode.rect[0], origin[1] + qrcode.rect[1], qrcode.rect[2], qrcode.rect[3]))
+            for qrcode in qrcodes]
 
-def detect(camera, timer=1.0, crop_ratio=1):
+
+class ParallelDecoder:
+    # Decode the regions of frames found by a QRDetector in several variants across the thread
+    # pool, and vote on the results
+    # A frame casts at most one vote per code, however many of its variants decode it, so that
+    # a code is still only confirmed over several frames; once all the decodes of a frame are
+    # finished (or dropped), its codes update the region tracked by the detector
+    # Decodes are submitted without waiting for the previous frames, and dropped once the frame is
+    # older than the deadline
+
+    def __init__(self, policy, detector, variants=DECODE_VARIANTS, deadline=FRAME_DEADLINE, max_in_flight=MAX_FRAMES_IN_FLIGHT):
+        self.policy = policy
+        self.detector = detector
+        self.variants = variants
+        self.deadline = deadline
+        self.max_in_flight = max_in_flight
+        self.executor = _get_decode_executor()
+        # future -> (capture timestamp, frame index)
+        self.pending = {}
+        self.frames = collections.OrderedDict()     # frame index -> capture timestamp
+        self.voted = {}                             # frame index -> {code: rect} it has voted for
+        self.index = 0
+        self.confirmed = None
+        self.detections = []
+
+    def submit(self, image, timestamp):
+        # Queue the decoding of a BGR image captured at `timestamp` (time.monotonic() clock)
+        # Returns False if the frame was skipped
+        self._drop_late()
+        if len(self.frames) >= self.max_in_flight:
+            # Too many frames in flight: drop this one rather than falling behind the camera
+            return False
+        roi = self.detector.region(image)
+        if roi is None:
+            return False
+        # Copied out of the detector buffer, which the next frame overwrites
+        x, y, w, h = roi
+        gray = self.detector.gray[y:y+h, x:x+w].copy()
+        for variant in self.variants:
+            future = self.executor.submit(_decode_variant, gray, variant, (x, y))
+            self.pending[future] = (timestamp, self.index)
+        self.frames[self.index] = timestamp
+        self.index += 1
+        return True
+
+    def _drop_late(self):
+        # Cancel the decodes of frames past their deadline
+        now = time.monotonic()
+        for future, (timestamp, index) in list(self.pending.items()):
+            if now - timestamp > self.deadline:
+                future.cancel()
+                del self.pending[future]
+        self._forget_frames()
+
+    def _forget_frames(self):
+        in_flight = {index for _, index in self.pending.values()}
+        for index in list(self.frames):
+            if index not in in_flight:
+                del self.frames[index]
+                self.detector.track(list(self.voted.pop(index, {}).items()))
+
+    def collect(self, timeout=0):
+        # Count the votes of the finished decodes: return the confirmed code, if any
+        if self.pending and self.confirmed is None:
+            done, _ = wait(list(self.pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            self.detections = []
+            for future in done:
+                timestamp, index = self.pending.pop(future)
+                if future.cancelled() or future.exception() is not None:
+                    continue
+                voted = self.voted.setdefault(index, {})
+                for code_info, rect in future.result():
+                    if code_info in voted:
+                        continue
+                    voted[code_info] = rect
+                    self.detections.append((code_info, rect))
+                    if self.policy.add(code_info, timestamp):
+                        self.confirmed = code_info
+                        self.cancel()
+                        break
+                if self.confirmed is not None:
+                    break
+            self._forget_frames()
+        return self.confirmed
+
+    def cancel(self):
+        # Cancel every decode that has not started yet
+        for future in self.pending:
+            future.cancel()
+        self.pending = {}
+        self.frames.clear()
+        self.voted.clear()
+
+
+def _read(camera, image=None):
+    # Next frame with its capture timestamp (see cameras.Camera.read_new); plain captures are
+    # timestamped when the read returns
+    if hasattr(camera, 'read_new'):
+        return camera.read_new(image=image)
+    success, image = camera.read(image)
+    return success, image, time.monotonic()
+
+
+def detect(camera, timer=1.0, crop_ratio=1, stop_event=None, policy=None, parallel=PARALLEL_DECODING):
 
     end_time = time.time() + timer
 
     # Capture the first video frame
-    success, frame = camera.read()
+    success, frame, timestamp = _read(camera)
     if not success:
         print("Camera could not be read")
-        return False
+        return None
 
     # Find the position of each border
     height, width, _ = frame.shape
@@ -26,41 +322,53 @@ def detect(camera, timer=1.0, crop_ratio=1):
     left_border = int((width/2) - (side_length/2))
     right_border = int((width/2) + (side_length/2))
 
-    data = {}
+    if policy is None:
+        policy = ConfidencePolicy()
+    detector = QRDetector()
+    if parallel:
+        decoder = ParallelDecoder(policy, detector)
     final_data = None
 
     while(time.time() < end_time):
 
+        # Stop early if another concurrent check asked for it
+        if (stop_event is not None) and stop_event.is_set():
+            break
+
         # Slice the initial image
-        frame = frame[top_border:bottom_border, left_border:right_border]
+        center_frame = frame[top_border:bottom_border, left_border:right_border]
 
-        # Find and decode QR codes
-        qrcodes = pyzbar.decode(frame, symbols=[ZBarSymbol.QRCODE])
-       
-        for qrcode in qrcodes:
-            code_info = qrcode.data.decode('utf-8')
-            
-            # Check that QR code has been decoded reliably multiple (3) times
-            previous_occurrences = data.get(code_info, 0)
-            if previous_occurrences >= (REPEATED_DETECTIONS-1):
-                final_data = code_info
-                break
-            
-            data[code_info] = previous_occurrences + 1
+        if parallel:
+            # Queue the frame, and count the votes of the decodes finished so far
+            decoder.submit(center_frame, timestamp)
+            final_data = decoder.collect()
+            detections = decoder.detections
+        else:
+            # Find and decode QR codes
+            detections = []
+            for code_info, rect in detector.decode(center_frame):
+                detections.append((code_info, rect))
 
-            # Overlay detected QR codes on the frame
-            x, y , w, h = qrcode.rect
-            cv2.rectangle(frame, (x, y),(x+w, y+h), (0, 255, 0), 2)
-            font = cv2.FONT_HERSHEY_DUPLEX
-            cv2.putText(frame, code_info, (x + 6, y - 6), font, 0.5, (255, 255, 255), 1)
+                # Check that QR code has been decoded reliably multiple times
+                if policy.add(code_info, timestamp):
+                    final_data = code_info
+                    break
+
+        # Overlay detected QR codes on the frame
+        if (final_data is None) and display.enabled():
+            for code_info, rect in detections:
+                x, y , w, h = rect
+                cv2.rectangle(center_frame, (x, y),(x+w, y+h), (0, 255, 0), 2)
+                font = cv2.FONT_HERSHEY_DUPLEX
+                cv2.putText(center_frame, code_info, (x + 6, y - 6), font, 0.5, (255, 255, 255), 1)
 
         if final_data is not None:
             break
 
-        cv2.imshow('detectionFrame', frame)
+        display.show('detectionFrame', center_frame)
 
         # Capture the next video frame
-        success, frame = camera.read()
+        success, frame, timestamp = _read(camera, frame)
         if not success:
             print("Camera could not be read")
             break
@@ -68,40 +376,24 @@ def detect(camera, timer=1.0, crop_ratio=1):
         # the 'q' button is set as the
         # quitting button you may use any
         # desired button of your choice
-        if cv2.waitKey(100) & 0xFF == ord('q'): #40 for 25Hz
+        if display.quit_requested():
             break
 
+    if parallel:
+        # Give the decodes still in flight a chance to confirm the code
+        drain_end = time.monotonic() + FRAME_DEADLINE
+        while (final_data is None) and decoder.pending and (time.monotonic() < drain_end):
+            if (stop_event is not None) and stop_event.is_set():
+                break
+            final_data = decoder.collect(timeout=drain_end - time.monotonic())
+        decoder.cancel()
+
     # Destroy all the windows
-    cv2.destroyAllWindows()
+    display.clear()
 
     return final_data
 
 
-TYPES = {0: "box", 1: "cup"}
-
-def process(string):
-    splits = string.split('/')
-    if (splits[-2] is None) or (splits[-2] != "wearecauli.test-app.link"):
-        return None
-    
-    data = splits[-1]
-    fields = data.split('-')
-    if len(fields) != 7:
-        return None
-    if (fields[0] is None) or (fields[0] != "container"):
-        return None
-    
-    type = TYPES.get(int(fields[1]), "unknown")
-    if type == "unknown":
-        return None
-    id = fields[2]
-    for f in fields[3:]:
-        id = id + '-' + f
-
-    return {'type': type, 'id': id}
-
-
-
 if __name__ == "__main__":
 
     print(process("https://wearecauli.test-app.link/container-0001-8295f584-f45d-490c-5466-2654a546"))
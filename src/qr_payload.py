@@ -0,0 +1,55 @@
+# Import libraries
+import re
+from functools import lru_cache
+
+
+PAYLOAD_HOST = "wearecauli.test-app.link"
+TYPES = {0: "box", 1: "cup"}
+
+# Number of distinct payloads kept in the parsing cache (repeat scans of the same container)
+PAYLOAD_CACHE_SIZE = 1024
+
+# .../<host>/container-<type>-<5 id fields>, where the last path segment has exactly 7 '-' separated fields
+PAYLOAD_PATTERN = re.compile(r'(?:.*/)?' + re.escape(PAYLOAD_HOST) + r'/container-([^-/]*)-([^-/]*(?:-[^-/]*){4})', re.DOTALL)
+
+
+@lru_cache(maxsize=PAYLOAD_CACHE_SIZE)
+def _parse(string):
+    # Return (type, id), or None if the payload is not a valid container link
+    match = PAYLOAD_PATTERN.fullmatch(string)
+    if match is None:
+        return None
+    type_field, id = match.groups()
+    try:
+        type = TYPES.get(int(type_field), "unknown")
+    except ValueError:
+        return None
+    if type == "unknown":
+        return None
+    return (type, id)
+
+def process(string):
+    # Parse the data of a QR code: {'type': ..., 'id': ...}, or None if it is not a valid container link
+    if not isinstance(string, str):
+        return None
+    parsed = _parse(string)
+    if parsed is None:
+        return None
+    # A new dict every time, so that callers cannot alter the cached result
+    return {'type': parsed[0], 'id': parsed[1]}
+
+def process_many(strings):
+    # Parse a batch of QR code data (e.g. an exported scan log): one result per string, in order
+    results = []
+    append = results.append
+    parse = _parse
+    for string in strings:
+        parsed = parse(string) if isinstance(string, str) else None
+        append(None if parsed is None else {'type': parsed[0], 'id': parsed[1]})
+    return results
+
+def cache_info():
+    return _parse.cache_info()
+
+def clear_cache():
+    _parse.cache_clear()
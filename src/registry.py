@@ -0,0 +1,139 @@
+# Import libraries
+import os
+import csv
+import logging
+import sqlite3
+import threading
+
+
+REGISTRY_PATH = './data/containers.db'
+# Number of rows inserted per statement batch during bulk imports
+BULK_BATCH_SIZE = 50000
+
+# Containers known before the registry existed, imported when a new registry is created
+SEED_CONTAINERS = [
+    ('cup', '8295f584-f45d-490c-5466-2654a546'),
+    ('cup', '8288f584-dd6f-490c-8137-2b85f49ff488'),
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS containers (
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (type, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+"""
+
+
+class ContainerRegistry:
+    # Issued container IDs, in a local SQLite database indexed on (type, id): lookups are a
+    # B-tree search, and imports/syncs are single transactions
+    # One connection shared between threads, serialised by a lock
+
+    def __init__(self, path=REGISTRY_PATH, seed=SEED_CONTAINERS):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(SCHEMA)
+        if seed and self.count() == 0:
+            self.bulk_import(seed)
+
+    def contains(self, c_type, c_id):
+        with self._lock:
+            row = self._connection.execute('SELECT 1 FROM containers WHERE type = ? AND id = ?', (c_type, c_id)).fetchone()
+        return row is not None
+
+    def count(self, c_type=None):
+        with self._lock:
+            if c_type is None:
+                return self._connection.execute('SELECT COUNT(*) FROM containers').fetchone()[0]
+            return self._connection.execute('SELECT COUNT(*) FROM containers WHERE type = ?', (c_type,)).fetchone()[0]
+
+    def _insert(self, containers, batch_size):
+        # Insert (type, id) pairs in batches, inside the caller's transaction
+        inserted = 0
+        batch = []
+        for container in containers:
+            batch.append((container[0], container[1]))
+            if len(batch) >= batch_size:
+                inserted += self._connection.executemany('INSERT OR IGNORE INTO containers VALUES (?, ?)', batch).rowcount
+                batch = []
+        if batch:
+            inserted += self._connection.executemany('INSERT OR IGNORE INTO containers VALUES (?, ?)', batch).rowcount
+        return inserted
+
+    def bulk_import(self, containers, batch_size=BULK_BATCH_SIZE):
+        # Import an iterable of (type, id) pairs in one transaction; returns the number of new containers
+        with self._lock:
+            self._connection.execute('BEGIN')
+            try:
+                inserted = self._insert(containers, batch_size)
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        logging.debug(f'Imported {inserted} containers into the registry.')
+        return inserted
+
+    def import_csv(self, path, batch_size=BULK_BATCH_SIZE):
+        # Import a CSV file of "type,id" rows (rows that do not have both fields are skipped)
+        with open(path, newline='') as f:
+            rows = (row for row in csv.reader(f) if len(row) >= 2)
+            return self.bulk_import(rows, batch_size)
+
+    def apply_delta(self, added=(), removed=(), version=None):
+        # Apply an incremental sync in one transaction: containers issued and withdrawn since the
+        # last sync, and the version of the registry they bring us to
+        with self._lock:
+            self._connection.execute('BEGIN')
+            try:
+                inserted = self._insert(added, BULK_BATCH_SIZE)
+                deleted = self._connection.executemany('DELETE FROM containers WHERE type = ? AND id = ?',
+                                                       ((c[0], c[1]) for c in removed)).rowcount
+                if version is not None:
+                    self._connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(version),))
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        logging.debug(f'Registry delta applied: {inserted} added, {deleted} removed, version {version}.')
+        return inserted, deleted
+
+    def version(self):
+        # Version of the last delta applied, None if the registry was never synced
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return None if row is None else row[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get(path=REGISTRY_PATH):
+    # Return the shared registry, opening it on first use
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ContainerRegistry(path)
+        return _registry
+
+
+def close():
+    global _registry
+    with _registry_lock:
+        if _registry is not None:
+            _registry.close()
+            _registry = None
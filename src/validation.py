@@ -0,0 +1,89 @@
+# Import libraries
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from . import colour_detection
+from . import qr_code
+from . import load_cells
+from . import backend
+from . import metrics
+
+
+COLOUR_CROP_RATIO = 1/2
+QR_CROP_RATIO = 2/3
+WEIGHT_RETRY_PAUSE = 0.25
+
+# Long-lived pool so that no thread is created during a collection cycle
+_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='validation')
+
+
+def _check_colour(camera, timer, stop_event):
+    with metrics.span('colour'):
+        return colour_detection.start(camera=camera, timer=timer, crop_ratio=COLOUR_CROP_RATIO, stop_event=stop_event)
+
+def _check_qr_code(camera, timer, stop_event):
+    # Detect the QR code, then check its data against the backend straight away
+    # so that an invalid container cancels the other checks as early as possible
+    with metrics.span('qr_code'):
+        code = qr_code.detect(camera, timer=timer, crop_ratio=QR_CROP_RATIO, stop_event=stop_event)
+    if code is None:
+        return None, None, False
+    cup = qr_code.process(code)
+    if cup is None:
+        return code, None, False
+    with metrics.span('backend_check'):
+        valid = backend.check_container(cup)
+    return code, cup, valid
+
+def _check_weight(timer, stop_event):
+    with metrics.span('weight'):
+        return _wait_for_weight(timer, stop_event)
+
+def _wait_for_weight(timer, stop_event):
+    # The object may still be settling on the platform: keep weighing until the weight is valid
+    end_time = time.time() + timer
+    while True:
+        if load_cells.check_weight():
+            return True
+        if (time.time() >= end_time) or stop_event.is_set():
+            return False
+        stop_event.wait(WEIGHT_RETRY_PAUSE)
+
+
+def run(side_camera, top_camera, colour_timer=5.0, qr_timer=8.0, weight_timer=8.0):
+    # Run the colour, QR code and weight checks concurrently
+    # The first check that fails cancels the others
+    stop_event = threading.Event()
+    futures = {
+        _executor.submit(_check_colour, side_camera, colour_timer, stop_event): 'colour',
+        _executor.submit(_check_qr_code, top_camera, qr_timer, stop_event): 'qr_code',
+        _executor.submit(_check_weight, weight_timer, stop_event): 'weight',
+    }
+
+    result = {'colour': False, 'code': None, 'cup': None, 'container': False, 'weight': False, 'failed': None}
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = futures[future]
+            try:
+                if name == 'qr_code':
+                    result['code'], result['cup'], result['container'] = future.result()
+                    passed = result['container']
+                    if result['code'] is not None:
+                        # A QR code was read, but its data is not valid
+                        name = 'container'
+                else:
+                    result[name] = passed = future.result()
+            except Exception:
+                logging.exception(f'Validation check "{name}" raised an exception.')
+                passed = False
+
+            if not passed and result['failed'] is None:
+                logging.debug(f'Validation check "{name}" failed, cancelling the other checks.')
+                result['failed'] = name
+                stop_event.set()
+
+    return result